@@ -0,0 +1,191 @@
+"""
+Benchmark suite for the classification pipeline
+
+Usage:
+    python benchmark.py --sizes 1000 10000 100000 --models LR RF --output benchmark.jsonl
+
+Synthetic cohorts (see synthetic.py) of each requested size go through every stage of
+classification.py: building the Model (encoding, feature selection, scaling), majority
+class subsampling, SMOTE, cross validation of each model and the rendering of each
+runClassification output format. The wall time and peak resident memory of every stage
+are appended to a JSON lines file together with the commit they were measured on, so
+that runs on different commits can be compared with --compare.
+
+Peak memory is measured by resetting the peak RSS of the process before each stage
+(/proc/self/clear_refs, Linux 4.0+). Elsewhere the peak since the start of the run is
+reported instead. SVM scales quadratically with the number of students and is best left
+out of runs above 10^5 students.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import scipy
+import sklearn
+import classification
+import ingest
+import instrument
+import synthetic
+
+
+def gitCommit():
+    """ Hash of the checked out commit, with a + suffix when the tree has local changes """
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=here).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+' if dirty else '')
+
+
+def measure(function, *args, **kwargs):
+    """ Run function and measure its wall time and memory use.
+
+    Returns
+    --------
+    (object, dict)
+        The result of function, and a dict with the seconds it took, the peak RSS
+        of the process while it ran (peakMB) and the growth of the peak RSS over the
+        RSS it started from (deltaMB), both in MB
+    """
+    gc.collect()
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        pass
+    before = instrument.memory()['rssMB']
+    start = time.time()
+    result = function(*args, **kwargs)
+    seconds = time.time() - start
+    peak = instrument.memory()['peakMB']
+    return result, {'seconds': seconds, 'peakMB': peak, 'deltaMB': peak - before if before is not None else None}
+
+
+def quietly(function, *args, **kwargs):
+    """ Run function with its printed output discarded """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return function(*args, **kwargs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def run(sizes, models, formats, nFolds=10, nSchools=50, sparse=False, fromCsv=False, nJobs=None, seed=0):
+    """ Benchmark every stage for every cohort size.
+
+    Returns
+    --------
+    generator
+        Yields one record (dict) per stage, model and output format
+    """
+    context = {'commit': gitCommit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'host': platform.node(), 'python': platform.python_version(), 'numpy': np.__version__,
+               'scipy': scipy.__version__, 'sklearn': sklearn.__version__, 'nFolds': nFolds,
+               'nSchools': nSchools, 'sparse': sparse, 'nJobs': nJobs}
+
+    for n in sizes:
+        def record(stage, stats, model=None, **extra):
+            out = dict(context, rows=n, stage=stage, model=model)
+            out.update(stats); out.update(extra)
+            return out
+
+        df, stats = measure(synthetic.cohort, n, nSchools=nSchools, seed=seed)
+        yield record('generate', stats, columns=df.shape[1])
+
+        if fromCsv:
+            path = tempfile.mktemp(suffix='.csv')
+            synthetic.writeCohort(path, n, nSchools=nSchools, seed=seed)
+            try:
+                df, stats = measure(ingest.readCohort, path)
+            finally:
+                os.remove(path)
+            yield record('ingest', stats, columns=df.shape[1])
+
+        schools = [c for c in df.columns if c.startswith('school')]
+        pred, stats = measure(quietly, classification.Model, df, 'nograd', categorical=schools,
+                              dtype=np.float32 if sparse else np.float64, sparse=sparse)
+        del df
+        yield record('preprocess', stats, features=pred.dataset.shape[1])
+
+        everyone = np.arange(len(pred.labels))
+        train, stats = measure(pred.subsample, pred.dataset, pred.labels, everyone, 1.0)
+        yield record('subsample', stats, trainRows=len(train))
+
+        minority = pred.dataset[pred.labels == 1]
+        samples, stats = measure(pred.SMOTE, minority, 100, 5, random_state=seed)
+        yield record('smote', stats, syntheticRows=samples.shape[0])
+        del minority, samples
+
+        for model in models:
+            _, stats = measure(quietly, pred.crossValidate, model, nFolds=nFolds, seed=seed, nJobs=nJobs)
+            yield record('crossValidate', stats, model=model)
+            for outputFormat in formats:
+                _, stats = measure(quietly, pred.runClassification, outputFormat=outputFormat, models=[model],
+                                   nFolds=nFolds, seed=seed)
+                yield record('output:' + outputFormat, stats, model=model)
+        del pred
+
+
+def compare(records, baselinePath):
+    """ Print the time and peak memory of records relative to a previous run """
+    baseline = {}
+    with open(baselinePath) as f:
+        for line in f:
+            r = json.loads(line)
+            baseline[(r['rows'], r['stage'], r['model'])] = r
+    print '%-10s %-16s %-6s %-12s %-12s %-12s %-12s' % ('Rows', 'Stage', 'Model', 'Seconds', 'Ratio', 'Peak MB', 'Ratio')
+    for r in records:
+        b = baseline.get((r['rows'], r['stage'], r['model']))
+        if b is None:
+            continue
+        print '%-10d %-16s %-6s %-12.3f %-12.2f %-12.1f %-12.2f' % (
+            r['rows'], r['stage'], r['model'] or '', r['seconds'], r['seconds'] / max(b['seconds'], 1e-9),
+            r['peakMB'], r['peakMB'] / max(b['peakMB'], 1e-9))
+
+
+def main():
+    import matplotlib
+    matplotlib.use('Agg')
+
+    parser = argparse.ArgumentParser(description='Time and measure the memory of every pipeline stage')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='numbers of students')
+    parser.add_argument('--models', nargs='+', default=sorted(classification.clfs), help='model codes to benchmark')
+    parser.add_argument('--formats', nargs='+', default=classification.OUTPUT_FORMATS, help='output formats to render')
+    parser.add_argument('--folds', type=int, default=10, help='number of cross validation folds')
+    parser.add_argument('--schools', type=int, default=50, help='number of school codes, 0 for none')
+    parser.add_argument('--sparse', action='store_true', help='keep the processed dataset sparse')
+    parser.add_argument('--ingest', action='store_true', help='also time reading the cohort from CSV')
+    parser.add_argument('--jobs', type=int, default=None, help='number of cores used by cross validation')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the cohorts and folds')
+    parser.add_argument('--output', default='benchmark.jsonl', help='JSON lines file the results are appended to')
+    parser.add_argument('--compare', default=None, help='JSON lines file of a previous run to compare with')
+    args = parser.parse_args()
+
+    records = []
+    print '%-10s %-16s %-6s %-12s %-12s %-12s' % ('Rows', 'Stage', 'Model', 'Seconds', 'Peak MB', 'Delta MB')
+    with open(args.output, 'a') as out:
+        for r in run(args.sizes, args.models, args.formats, args.folds, args.schools, args.sparse,
+                     args.ingest, args.jobs, args.seed):
+            out.write(json.dumps(r, sort_keys=True) + '\n')
+            out.flush()
+            records.append(r)
+            print '%-10d %-16s %-6s %-12.3f %-12.1f %-12.1f' % (r['rows'], r['stage'], r['model'] or '',
+                                                               r['seconds'], r['peakMB'], r['deltaMB'] or 0)
+    if args.compare:
+        print '\n'
+        compare(records, args.compare)
+
+
+if __name__ == '__main__':
+    main()
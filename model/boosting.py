@@ -0,0 +1,331 @@
+"""
+Histogram Gradient Boosting
+"""
+
+#########################################################################################
+# Gradient boosted trees on quantile-binned features. Every feature is mapped once to   #
+# at most 256 bins stored as uint8, and trees are grown level by level from per-node    #
+# histograms of the gradient and hessian of the logistic loss, so that finding a split #
+# costs one pass over the rows of a node instead of a sort of every feature. The        #
+# histogram of the larger child of every split is the difference between its parent's #
+# and its sibling's. Bins can be computed once on the whole dataset and shared by every #
+# cross validation fold, and boosting stops early on a held-out slice of each fold.     #
+#########################################################################################
+
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.utils import check_random_state
+
+
+class QuantileBins:
+
+    def __init__(self, edges):
+        """ Bin thresholds of every feature.
+
+        Parameters
+        ----------
+        edges : list
+            One sorted np.ndarray of thresholds per feature. Values up to the first
+            threshold fall in bin 0, values above the last one in bin len(thresholds)
+
+        """
+        self.edges = [np.asarray(e, dtype=np.float64) for e in edges]
+        digest = hashlib.sha1()
+        for e in self.edges:
+            digest.update(str(len(e))); digest.update(e.data)
+        self.digest = digest.hexdigest()
+
+
+    def __repr__(self):
+        # Part of the prediction cache keys, see predictions.predictionKey
+        return 'QuantileBins(%d features, %s)' % (len(self.edges), self.digest[:16])
+
+
+    def take(self, columns):
+        """ The bins of a reordered or reduced set of features """
+        return QuantileBins([self.edges[j] for j in columns])
+
+
+    def transform(self, X):
+        """ Bin indexes of the features of X.
+
+        X may have fewer columns than there are features, e.g. the leading columns of
+        a grade sweep, in which case the bins of its leading features are used.
+
+        Returns
+        --------
+        np.ndarray
+            A Fortran ordered uint8 array of the same shape as X
+        """
+        if X.shape[1] > len(self.edges):
+            raise ValueError('Bins of %d features cannot bin %d columns' % (len(self.edges), X.shape[1]))
+        if sp.issparse(X):
+            X = X.tocsc()
+        out = np.empty(X.shape, dtype=np.uint8, order='F')
+        for j in xrange(X.shape[1]):
+            column = X[:, j].toarray().ravel() if sp.issparse(X) else X[:, j]
+            out[:, j] = np.searchsorted(self.edges[j], column, side='left')
+        return out
+
+
+def quantileBins(X, maxBins=256, sampleSize=200000, random_state=0):
+    """ Quantile bins of every column of X.
+
+    Columns with at most maxBins distinct values get one bin per value, the others
+    maxBins bins holding about the same number of rows each.
+
+    Parameters
+    ----------
+    X : np.ndarray or scipy.sparse matrix
+        The dataset
+    maxBins : int
+        The largest number of bins per feature, at most 256
+    sampleSize : int
+        Quantiles are computed on a random sample of this many rows
+    random_state : int, np.random.RandomState or None
+        Seed of the sample
+
+    Returns
+    --------
+    QuantileBins
+        The bins of every column
+    """
+    if not 2 <= maxBins <= 256:
+        raise ValueError('maxBins must be between 2 and 256')
+    if X.shape[0] > sampleSize:
+        rows = np.sort(check_random_state(random_state).choice(X.shape[0], sampleSize, replace=False))
+        X = X[rows]
+    if sp.issparse(X):
+        X = X.tocsc()
+    edges = []
+    for j in xrange(X.shape[1]):
+        column = X[:, j].toarray().ravel() if sp.issparse(X) else np.asarray(X[:, j])
+        values = np.unique(column)
+        if len(values) <= maxBins:
+            # Midpoints between consecutive distinct values
+            edges.append((values[:-1] + values[1:]) / 2.)
+        else:
+            edges.append(np.unique(np.percentile(column, np.linspace(0, 100, maxBins + 1)[1:-1])))
+    return QuantileBins(edges)
+
+
+class HistGradientBoostingClassifier(BaseEstimator, ClassifierMixin):
+
+    def __init__(self, n_estimators=100, learning_rate=0.1, max_depth=4, min_child_weight=1.0,
+                 l2_regularization=1.0, subsample=1.0, max_bins=256, bins=None, validation_fraction=0.1,
+                 n_iter_no_change=10, tol=1e-5, random_state=None):
+        """ Binary gradient boosting classifier on histograms of binned features.
+
+        Parameters
+        ----------
+        n_estimators : int
+            The largest number of boosting rounds
+        learning_rate : float
+            Shrinkage of the contribution of every tree
+        max_depth : int
+            The depth of the trees
+        min_child_weight : float
+            The smallest sum of hessians of a leaf, i.e. of p(1-p) over its rows
+        l2_regularization : float
+            L2 penalty on the leaf values
+        subsample : float
+            The fraction of the training rows every tree is grown on
+        max_bins : int
+            The largest number of bins per feature, at most 256
+        bins : QuantileBins or None
+            Precomputed bins, e.g. shared by every fold of a cross validation. By
+            default the bins are computed on the training set
+        validation_fraction : float or None
+            The fraction of the training set held out for early stopping, None to
+            always run n_estimators rounds
+        n_iter_no_change : int
+            Boosting stops when the validation loss has not improved for this many rounds
+        tol : float
+            The smallest improvement of the validation loss that counts
+        random_state : int, np.random.RandomState or None
+            Seed of the validation split, the row subsamples and the bin sample
+
+        """
+        self.n_estimators = n_estimators
+        self.learning_rate = learning_rate
+        self.max_depth = max_depth
+        self.min_child_weight = min_child_weight
+        self.l2_regularization = l2_regularization
+        self.subsample = subsample
+        self.max_bins = max_bins
+        self.bins = bins
+        self.validation_fraction = validation_fraction
+        self.n_iter_no_change = n_iter_no_change
+        self.tol = tol
+        self.random_state = random_state
+
+
+    def fit(self, X, y):
+        rs = check_random_state(self.random_state)
+        self.classes_, y = np.unique(y, return_inverse=True)
+        if len(self.classes_) != 2:
+            raise ValueError('HistGradientBoostingClassifier only handles two classes')
+        self.bins_ = self.bins if self.bins is not None else quantileBins(X, self.max_bins, random_state=rs)
+        Xb = self.bins_.transform(X)
+        self.n_bins_ = max(len(e) for e in self.bins_.edges[:X.shape[1]]) + 1 if X.shape[1] else 1
+        y = y.astype(np.float64)
+
+        # Stratified hold-out slice for early stopping
+        validation = np.zeros(len(y), dtype=bool)
+        if self.validation_fraction:
+            for c in (0, 1):
+                members = np.flatnonzero(y == c)
+                validation[rs.choice(members, int(round(len(members) * self.validation_fraction)), replace=False)] = True
+        train = np.flatnonzero(~validation); held = np.flatnonzero(validation)
+        Xv = Xb[held]; yv = y[held]
+        if len(held):
+            # Row selections come back C ordered, histograms read one column at a time
+            Xb = np.asfortranarray(Xb[train]); y = y[train]
+
+        p = np.clip(y.mean(), 1e-12, 1 - 1e-12)
+        self.init_ = np.log(p / (1 - p))
+        raw = np.empty(len(y)); raw.fill(self.init_)
+        rawValidation = np.empty(len(yv)); rawValidation.fill(self.init_)
+
+        self.trees_ = []; self.validation_loss_ = []
+        best = np.inf; bestRounds = 0
+        for i in xrange(self.n_estimators):
+            prob = _sigmoid(raw)
+            gradient = prob - y
+            hessian = prob * (1 - prob)
+            rows = None
+            if self.subsample < 1:
+                rows = np.flatnonzero(rs.random_sample(len(y)) < self.subsample)
+            tree, leaves = self._grow(Xb, gradient, hessian, rows)
+            self.trees_.append(tree)
+            raw += tree[4][leaves if rows is None else _apply(tree, Xb)]
+
+            if len(held):
+                rawValidation += tree[4][_apply(tree, Xv)]
+                loss = _logLoss(yv, rawValidation)
+                self.validation_loss_.append(loss)
+                if loss < best - self.tol:
+                    best = loss; bestRounds = i + 1
+                elif i + 1 - bestRounds >= self.n_iter_no_change:
+                    break
+        if len(held):
+            del self.trees_[bestRounds:]
+        self.n_estimators_ = len(self.trees_)
+        return self
+
+
+    def _grow(self, Xb, gradient, hessian, rows=None):
+        """ Grow one tree level by level.
+
+        Returns
+        --------
+        (tuple, np.ndarray)
+            The tree as arrays (feature, threshold, left, right, value), and the leaf
+            of every row when rows is None
+        """
+        nFeatures = Xb.shape[1]; nBins = self.n_bins_; lam = self.l2_regularization
+        feature = [-1]; threshold = [0]; left = [-1]; right = [-1]; value = [0.]
+
+        def histogram(ix):
+            g = gradient[ix]; h = hessian[ix]
+            G = np.empty((nFeatures, nBins)); H = np.empty((nFeatures, nBins))
+            for j in xrange(nFeatures):
+                codes = Xb[ix, j]
+                G[j] = np.bincount(codes, weights=g, minlength=nBins)
+                H[j] = np.bincount(codes, weights=h, minlength=nBins)
+            return G, H
+
+        everyone = np.arange(Xb.shape[0]) if rows is None else rows
+        leaves = np.zeros(Xb.shape[0], dtype=np.intp) if rows is None else None
+        G, H = histogram(everyone)
+        frontier = [(0, everyone, G, H, G[0].sum(), H[0].sum())]
+        for depth in xrange(self.max_depth + 1):
+            nextFrontier = []
+            for node, ix, G, H, gSum, hSum in frontier:
+                value[node] = -self.learning_rate * gSum / (hSum + lam)
+                if G is None or len(ix) < 2:
+                    continue
+
+                # Gain of every (feature, bin) split, rows up to the bin going left
+                GL = np.cumsum(G, axis=1)[:, :-1]; HL = np.cumsum(H, axis=1)[:, :-1]
+                GR = gSum - GL; HR = hSum - HL
+                gain = GL ** 2 / (HL + lam) + GR ** 2 / (HR + lam) - gSum ** 2 / (hSum + lam)
+                gain[(HL < self.min_child_weight) | (HR < self.min_child_weight)] = -np.inf
+                best = np.argmax(gain)
+                f, b = divmod(best, gain.shape[1])
+                if not gain[f, b] > 1e-12:
+                    continue
+
+                goLeft = Xb[ix, f] <= b
+                leftRows = ix[goLeft]; rightRows = ix[~goLeft]
+                leftId = len(feature); rightId = leftId + 1
+                feature[node] = f; threshold[node] = b; left[node] = leftId; right[node] = rightId
+                feature.extend([-1, -1]); threshold.extend([0, 0]); left.extend([-1, -1])
+                right.extend([-1, -1]); value.extend([0., 0.])
+                if leaves is not None:
+                    leaves[rightRows] = rightId; leaves[leftRows] = leftId
+
+                gLeft = GL[f, b]; hLeft = HL[f, b]
+                if depth + 1 == self.max_depth:
+                    # Children are leaves and only need their sums
+                    nextFrontier += [(leftId, leftRows, None, None, gLeft, hLeft),
+                                     (rightId, rightRows, None, None, gSum - gLeft, hSum - hLeft)]
+                elif len(leftRows) <= len(rightRows):
+                    # Histogram the smaller child only, the larger one is the difference
+                    GS, HS = histogram(leftRows)
+                    nextFrontier += [(leftId, leftRows, GS, HS, gLeft, hLeft),
+                                     (rightId, rightRows, G - GS, H - HS, gSum - gLeft, hSum - hLeft)]
+                else:
+                    GS, HS = histogram(rightRows)
+                    nextFrontier += [(leftId, leftRows, G - GS, H - HS, gLeft, hLeft),
+                                     (rightId, rightRows, GS, HS, gSum - gLeft, hSum - hLeft)]
+            frontier = nextFrontier
+            if not frontier:
+                break
+
+        tree = (np.array(feature, dtype=np.intp), np.array(threshold, dtype=np.intp), np.array(left, dtype=np.intp),
+                np.array(right, dtype=np.intp), np.array(value))
+        return tree, leaves
+
+
+    def decision_function(self, X):
+        Xb = self.bins_.transform(X)
+        raw = np.empty(X.shape[0]); raw.fill(self.init_)
+        for tree in self.trees_:
+            raw += tree[4][_apply(tree, Xb)]
+        return raw
+
+
+    def predict_proba(self, X):
+        p = _sigmoid(self.decision_function(X))
+        return np.column_stack((1 - p, p))
+
+
+    def predict(self, X):
+        return self.classes_[(self.decision_function(X) > 0).astype(int)]
+
+
+def _sigmoid(raw):
+    return 1. / (1. + np.exp(-raw))
+
+
+def _logLoss(y, raw):
+    # log(1 + exp(raw)) - y * raw, computed stably
+    return np.mean(np.logaddexp(0, raw) - y * raw)
+
+
+def _apply(tree, Xb):
+    """ The leaf of every row of binned data """
+    feature, threshold, left, right, value = tree
+    node = np.zeros(Xb.shape[0], dtype=np.intp)
+    active = np.arange(Xb.shape[0])
+    while len(active):
+        current = node[active]
+        f = feature[current]
+        internal = f >= 0
+        active = active[internal]; current = current[internal]
+        goLeft = Xb[active, f[internal]] <= threshold[current]
+        node[active] = np.where(goLeft, left[current], right[current])
+    return node
@@ -16,18 +16,34 @@ Classification Pipeline
 #                                    Version 1.0                                        #
 #########################################################################################
 
-from sklearn import preprocessing, decomposition, svm, cross_validation
+from sklearn import preprocessing, decomposition, svm
+from sklearn.base import clone
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier, GradientBoostingClassifier, AdaBoostClassifier
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.naive_bayes import GaussianNB
 from sklearn.neighbors import NearestNeighbors
 from sklearn.metrics import *
-import random
+import logging
+import os
+import re
+import time
 import numpy as np
-import matplotlib.pylab as pl
 import pandas as pd
+import scipy.sparse as sp
+import boosting
+import encoding
+import featurecache
+import instrument
+import metrics
+import pipeline
+import predictions
+import ranking
+import resampling
+import scheduler
 
+# Progress messages; results are printed
+logger = logging.getLogger(__name__)
 
 
 #####################################################################################
@@ -36,26 +52,77 @@ import pandas as pd
 # user wishes to run.                                                               #
 #####################################################################################
 
-# TODO: Abstract these following classifiers so they can be passed into runClassification with their own parameters
+# Parameters can be overridden per run by passing modelParams, e.g. {'RF': {'n_estimators': 200}},
+# to runClassification and the cross validation functions, see estimator and search.py
 clfs = {'RF': RandomForestClassifier(n_estimators=50, n_jobs=-1),
         'ET': ExtraTreesClassifier(n_estimators=10, n_jobs=-1, criterion='entropy'),
         'AB': AdaBoostClassifier(DecisionTreeClassifier(max_depth=1), algorithm="SAMME", n_estimators=200),
         'LR': LogisticRegression(penalty='l1', C=1e5),
+        'SGD': SGDClassifier(loss='log', penalty='l1', alpha=1e-4, random_state=0),
         'SVM': svm.SVC(kernel='linear', probability=True, random_state=0),
         'GB': GradientBoostingClassifier(learning_rate=0.05, subsample=0.5, max_depth=6, n_estimators=10),
+        'HGB': boosting.HistGradientBoostingClassifier(n_estimators=300, learning_rate=0.1, max_depth=4, subsample=0.5,
+                                                       random_state=0),
         'NB': GaussianNB(),
         'DT': DecisionTreeClassifier()
         }
 
+# Classifiers that cannot be trained on scipy sparse matrices
+DENSE_ONLY = (GaussianNB, GradientBoostingClassifier)
+
+# Grade-by-grade feature families, suffixed with the grade block number, and the
+# grade the first block corresponds to
+GRADE_FAMILIES = ['absrate', 'tardyr', 'nsusp', 'mobility', 'q1mpa', 'q2mpa', 'q3mpa', 'q4mpa', 'school']
+FIRST_GRADE = 6
+
+# Output formats accepted by runClassification
+OUTPUT_FORMATS = ['score', 'summary', 'matrix', 'roc', 'prc', 'topk', 'risk', 'metrics']
+
+# Fractions of students at highest risk reported by the 'metrics' output format
+TOPK_GRID = [.01, .02, .05, .1, .2, .3]
+
+# With smoteAlgorithm 'auto', minority sets of at most SMOTE_BRUTE_ROWS instances are
+# searched by brute force, and larger ones by a k-d tree unless they have more than
+# SMOTE_TREE_FEATURES features, beyond which a tree prunes too little to beat brute force
+SMOTE_BRUTE_ROWS = 2000
+SMOTE_TREE_FEATURES = 15
+
+
+def estimator(model, params=None):
+    """ The classifier of a model code, with params overriding the parameters set in clfs
+
+    Parameters
+    ----------
+    model : string
+        The 2-3 letter code of the classifier
+    params : dict or None
+        Parameters of the classifier, e.g. {'n_estimators': 200}
+
+    Returns
+    --------
+    sklearn estimator
+        The unfitted classifier, clfs[model] itself when there is nothing to override
+    """
+    if not params:
+        return clfs[model]
+    return clone(clfs[model]).set_params(**dict(params))
+
+
+def _frozen(params):
+    """ Hashable form of a parameter dict """
+    return tuple(sorted(params.items())) if params else None
+
 
 class Model:
 
-    def __init__(self, dataSet, dependentVar, doFeatureSelection=True, doPCA=False, nComponents=10):
+    def __init__(self, dataSet, dependentVar, doFeatureSelection=True, doPCA=False, nComponents=10,
+                 categorical=(), dtype=np.float64, sparse=False, cacheDir=None, cacheKey=None,
+                 cacheSize=featurecache.MAX_BYTES):
         """ Data pre-processing constructor.
 
         Constructor to pre-process pandas DataFrames, extracting and encoding the outcome
         labels (class), dropping them from the dataset and converting categorical variables
-        into integer numbers for compatibility with scikit-learn.
+        into dummy variables for compatibility with scikit-learn.
 
         Parameters
         ----------
@@ -69,18 +136,63 @@ class Model:
             A flag to denote whether or not to perform principle component analysis
         nComponents : int
             The desired number of principle components
+        categorical : list
+            Numeric columns to be one-hot encoded as well, e.g. school codes. Columns
+            of type object or category are always encoded
+        dtype : np.dtype
+            The type of the processed dataset, e.g. np.float32 to halve its memory
+        sparse : bool
+            A flag to denote whether to keep the processed dataset as a scipy sparse
+            matrix, so that dummy variables of high-cardinality columns are never
+            stored densely. Scaling then leaves values uncentered and PCA is replaced
+            by a truncated SVD
+        cacheDir : string or None
+            A directory where the outcome of preprocessing is stored. Constructing a
+            Model again from the same data and parameters then memory-maps the stored
+            dataset instead of preprocessing it, see featurecache
+        cacheKey : string or None
+            A string identifying the content of dataSet, e.g. the path and modification
+            time of the extract it was read from, used instead of hashing dataSet
+        cacheSize : int
+            The bound in bytes on the size of cacheDir, least recently used entries
+            are evicted beyond it
         
         """
-        # Encode nominal features to conform with sklearn
-        for i,tp in enumerate(dataSet.dtypes):
-            if tp == 'object': 
-                print 'Encoding feature \"' + dataSet.columns[i] + '\" ...'
-                print 'Old dataset shape: ' + str(dataSet.shape)
-                temp = pd.get_dummies(dataSet[dataSet.columns[i]],prefix=dataSet.columns[i])
-                dataSet = pd.concat([dataSet,temp],axis=1).drop(dataSet.columns[i],axis=1)
-                print 'New dataset shape: ' + str(dataSet.shape)
-                #unique_vals, dataSet.ix[:,i]  = np.unique(dataSet.ix[:,i] , return_inverse=True)
-                
+        # Reuse the outcome of an identical preprocessing run
+        key = None
+        if cacheDir is not None:
+            with instrument.span('cacheLookup', rows=dataSet.shape[0], columns=dataSet.shape[1]) as span:
+                key = featurecache.entryKey(cacheKey or featurecache.frameHash(dataSet), dependentVar=dependentVar,
+                                            doFeatureSelection=doFeatureSelection, doPCA=doPCA,
+                                            nComponents=nComponents if doPCA else None,
+                                            categorical=sorted(categorical), dtype=np.dtype(dtype).str, sparse=sparse)
+                entry = featurecache.load(cacheDir, key)
+                span['hit'] = entry is not None
+            if entry is not None:
+                arrays, state = entry
+                for name, value in state.items():
+                    setattr(self, name, value)
+                self.dataset = arrays['dataset']
+                self.labels = arrays['labels']
+                self.students = arrays.get('students', state.get('students'))
+                self.predictions = {}
+                self._quantileBins = {}
+                self._foldPlans = {}
+                logger.info('Loaded preprocessed dataset of shape %s from %s', self.dataset.shape, cacheDir)
+                return
+
+        # Encode nominal features to conform with sklearn, all of them in a single pass
+        with instrument.span('encode', rows=dataSet.shape[0], columns=dataSet.shape[1]) as span:
+            self.encoder = encoding.CategoricalEncoder(dtype=dtype, sparse=sparse)
+            self.encoder.fit(dataSet, exclude=[dependentVar], categorical=categorical)
+            for column in self.encoder.categorical:
+                logger.info('Encoding feature "%s" ...', column)
+            X = self.encoder.transform(dataSet)
+            span['features'] = X.shape[1]
+        if self.encoder.categorical:
+            logger.info('Old dataset shape: %s', dataSet.shape)
+            logger.info('New dataset shape: %s', X.shape)
+
         # Set the dependent variable (y) to the appropriate column
         y = dataSet.loc[:,dependentVar]
 
@@ -88,34 +200,65 @@ class Model:
         # This may be redundant at times
         labels = preprocessing.LabelEncoder().fit_transform(y)
 
-        # Remove the dependent variable from training sets
-        X = dataSet.drop(dependentVar,1).values
-        
-        # Perform entropy-based feature selection 
+        # Perform entropy-based feature selection, keeping features at least as
+        # important as the average one
+        self.featureMask = None
         if doFeatureSelection:
-            print 'Performing Feature Selection:'
-            print 'Shape of dataset before feature selection: ' + str(X.shape)
-            clf = DecisionTreeClassifier(criterion='entropy')
-            X = clf.fit(X, y).transform(X)
-            print 'Shape of dataset after feature selection: ' + str(X.shape) + '\n'
+            logger.info('Performing Feature Selection:')
+            logger.info('Shape of dataset before feature selection: %s', X.shape)
+            with instrument.span('featureSelection', rows=X.shape[0], columns=X.shape[1]) as span:
+                clf = DecisionTreeClassifier(criterion='entropy', random_state=0).fit(X, y)
+                self.featureMask = clf.feature_importances_ >= np.mean(clf.feature_importances_)
+                X = X[:, np.flatnonzero(self.featureMask)]
+                span['features'] = X.shape[1]
+            logger.info('Shape of dataset after feature selection: %s', X.shape)
         
-        # Normalize values
-        X = preprocessing.StandardScaler().fit(X).transform(X)
+        # Normalize values; sparse matrices can only be scaled without centering
+        with instrument.span('scale', rows=X.shape[0], features=X.shape[1]):
+            self.scaler = preprocessing.StandardScaler(copy=False, with_mean=not sparse)
+            X = self.scaler.fit_transform(X)
         
         # Collapse features using principal component analysis
+        self.pca = None
         if doPCA:
-            print 'Performing PCA'
-            estimator = decomposition.PCA(n_components=nComponents)
-            X = estimator.fit_transform(X)
-            print 'Shape of dataset after PCA: ' + str(X.shape) + '\n'
+            logger.info('Performing PCA')
+            with instrument.span('pca', rows=X.shape[0], columns=X.shape[1], features=nComponents):
+                if sparse:
+                    self.pca = decomposition.TruncatedSVD(n_components=nComponents)
+                else:
+                    self.pca = decomposition.PCA(n_components=nComponents)
+                X = self.pca.fit_transform(X)
+            logger.info('Shape of dataset after PCA: %s', X.shape)
             
+        # Remember which original column every processed feature comes from
+        self.featureSources = None
+        if self.pca is None:
+            self.featureSources = self.encoder.featureSources
+            if self.featureMask is not None:
+                self.featureSources = [self.featureSources[i] for i in np.flatnonzero(self.featureMask)]
+
         # Save processed dataset, labels and student ids
         self.dataset = X
         self.labels = labels
         self.students = dataSet.index
 
+        # Out-of-fold results of previous cross validation runs, see crossValidate
+        self.predictions = {}
+        self._datasetHash = None
+
+        # Quantile bins of the processed features by number of bins, see quantileBins,
+        # and seeded fold plans, see foldPlan
+        self._quantileBins = {}
+        self._foldPlans = {}
 
-    def subsample(self, x, y, ix, subsample_ratio=1.0):
+        if key is not None:
+            state = dict(encoder=self.encoder, featureMask=self.featureMask, scaler=self.scaler, pca=self.pca,
+                         featureSources=self.featureSources, _datasetHash=self.datasetHash())
+            featurecache.save(cacheDir, key, {'dataset': self.dataset, 'labels': self.labels,
+                                              'students': self.students}, state, cacheSize)
+
+
+    def subsample(self, x, y, ix, subsample_ratio=1.0, random_state=None):
         """ Data subsampling.
         
         This function takes in a list or array indexes that will be used for training
@@ -132,98 +275,401 @@ class Model:
             The array indexes for the instances that will be used for training
         subsample_ratio : float
             The desired ratio for subsampling
+        random_state : int, np.random.RandomState or None
+            Seed of the subsample
         
         Returns
         --------
         np.ndarray 
             The new list of array indexes to be used for training
         """
+        return resampling.subsample(y, ix, subsample_ratio, random_state)
+
 
-        # Get indexes of instances that belong to classes 0 and 1
-        indexes_0 = [item for item in ix if y[item] == 0]
-        indexes_1 = [item for item in ix if y[item] == 1]
+    def SMOTE(self, T, N, k, h = 1.0, algorithm='auto', random_state=None, batchSize=None):
+        """ Synthetic minority oversampling.
 
-        # Determine how large the new majority class set should be
-        sample_length = int(len(indexes_1)*subsample_ratio)
-        sample_indexes = random.sample(indexes_0, sample_length) + indexes_1
+        Returns (N/100) * n_minority_samples synthetic minority samples, see smote
+        below for a description of the parameters.
+        """
+        return smote(T, N, k, h, algorithm=algorithm, random_state=random_state, batchSize=batchSize)
 
-        return sample_indexes
 
+    def datasetHash(self):
+        """ Fingerprint of the processed dataset and labels, computed once """
+        if self._datasetHash is None:
+            self._datasetHash = predictions.fingerprint(self.dataset, self.labels)
+        return self._datasetHash
 
-    #############################################################
-    # SMOTE implementation by Karsten Jeschkies                 #
-    # The MIT License (MIT)                                     #
-    # Copyright (c) 2012-2013 Karsten Jeschkies <jeskar@web.de> # 
-    #                                                           #
-    # This is an implementation of the SMOTE Algorithm.         #
-    # See: "SMOTE: synthetic minority over-sampling technique"  #
-    # by Chawla, N.V et al.                                     #
-    #############################################################
 
-    def SMOTE(self, T, N, k, h = 1.0):
-        """ Synthetic minority oversampling.
+    def quantileBins(self, maxBins=256):
+        """ Quantile bins of every processed feature, computed once
+
+        Histogram based models (e.g. 'HGB') are handed these bins, so that every fold,
+        grade cutoff and final fit shares them instead of binning its own training set.
+
+        Returns
+        --------
+        boosting.QuantileBins
+            The bins of the columns of self.dataset
+        """
+        if maxBins not in self._quantileBins:
+            with instrument.span('quantileBins', rows=self.dataset.shape[0], features=self.dataset.shape[1]):
+                self._quantileBins[maxBins] = boosting.quantileBins(self.dataset, maxBins)
+        return self._quantileBins[maxBins]
+
+
+    def _withBins(self, clf, columns=None):
+        """ A copy of clf using the shared quantile bins, when it takes any
+
+        columns gives the order of the columns of the matrix clf is trained on, when
+        they are reordered from self.dataset.
+        """
+        params = clf.get_params()
+        if 'bins' not in params or params['bins'] is not None:
+            return clf
+        bins = self.quantileBins(params['max_bins'])
+        if columns is not None:
+            bins = bins.take(columns)
+        return clone(clf).set_params(bins=bins)
+
+
+    def foldPlan(self, nFolds=10, seed=None, subRate=None):
+        """ The fold plan of a cross validation run, drawn once per seed
+
+        Returns
+        --------
+        resampling.FoldPlan
+            The folds, shared by every run with the same seed. Runs without a seed
+            get a new plan every time
+        """
+        key = (nFolds, seed, subRate)
+        if seed is None or key not in self._foldPlans:
+            with instrument.span('foldPlan', rows=len(self.labels), nFolds=nFolds, subsampling=subRate is not None):
+                plan = resampling.FoldPlan(self.labels, nFolds, seed, subRate)
+            if seed is None:
+                return plan
+            self._foldPlans[key] = plan
+        return self._foldPlans[key]
+
+
+    def crossValidate(self, model, nFolds=10, doSubsampling=False, subRate=1.0, doSMOTE=False,
+                            pctSMOTE=100, smoteAlgorithm='auto', seed=None, cacheDir=None, nJobs=None,
+                            modelParams=None):
+        """ Out-of-fold predictions for a single model
+
+        Runs a stratified K-fold cross validation of one classifier and returns the
+        out-of-fold probabilities and predictions for every student. Results are kept
+        on the object, keyed by the model code, its parameters, the fold plan and a hash
+        of the processed dataset, so asking for them again does not refit anything.
+        See crossValidateModels for a description of the parameters.
+
+        Returns
+        --------
+        predictions.FoldPredictions
+            The out-of-fold results, with a 'smote' variant next to 'base' when doSMOTE is set
+        """
+        return self.crossValidateModels([model], nFolds=nFolds, doSubsampling=doSubsampling, subRate=subRate,
+                                        doSMOTE=doSMOTE, pctSMOTE=pctSMOTE, smoteAlgorithm=smoteAlgorithm,
+                                        seed=seed, cacheDir=cacheDir, nJobs=nJobs, modelParams=modelParams)[0]
+
 
-        Returns (N/100) * n_minority_samples synthetic minority samples.
+    def crossValidateModels(self, models, nFolds=10, doSubsampling=False, subRate=1.0, doSMOTE=False,
+                            pctSMOTE=100, smoteAlgorithm='auto', seed=None, cacheDir=None, nJobs=None,
+                            modelParams=None):
+        """ Out-of-fold predictions for several models at once
+
+        Every (model, fold, variant) combination that is not cached yet becomes an
+        independent task, and all tasks are run together by scheduler.runTasks, on a
+        pool of worker processes when nJobs is given.
 
         Parameters
         ----------
-        T : array-like, shape = [n_minority_samples, n_features]
-            Holds the minority samples
-        N : percetange of new synthetic samples: 
-            n_synthetic_samples = N/100 * n_minority_samples. Can be < 100.
-        k : int. Number of nearest neighbours. 
+        models : list
+            A list of classifiers to evaluate given by the 2-3 letter codes above
+        nFolds : int
+            The number of folds to be assigned to the K-fold process
+        doSubsampling : bool
+            Boolean value to determine whether to subsample the majority class
+        subRate : float
+            The ratio majority/minority to keep for training
+        doSMOTE : bool
+            Boolean value to determine whether or not to also train on a SMOTEd training set
+        pctSMOTE : int
+            The oversampling percentage to be used by SMOTE
+        smoteAlgorithm : string
+            The nearest neighbour backend used by SMOTE
+        seed : int or None
+            Seed for the fold assignment. Runs without a seed are never written to disk
+        cacheDir : string or None
+            A directory where results are persisted as .npz files and looked up on later runs
+        nJobs : int or None
+            The number of cores to spread the tasks over (-1 for all of them). Estimators
+            that parallelize internally are capped so the run stays within that budget.
+            By default everything runs in the current process
+        modelParams : dict or None
+            Parameters overriding those set in clfs, by model code, e.g.
+            {'RF': {'n_estimators': 200}}
 
         Returns
-        -------
-        S : Synthetic samples. array, 
-            shape = [(N/100) * n_minority_samples, n_features]. 
-        """    
-        n_minority_samples, n_features = T.shape
-        
-        if N < 100:
-            #create synthetic samples only for a subset of T.
-            #TODO: select random minortiy samples
-            N = 100
-            pass
-
-        if (N % 100) != 0:
-            raise ValueError("N must be < 100 or multiple of 100")
-        
-        N = N/100
-        n_synthetic_samples = N * n_minority_samples
-        S = np.zeros(shape=(n_synthetic_samples, n_features))
-        
-        #Learn nearest neighbours
-        neigh = NearestNeighbors(n_neighbors = k)
-        neigh.fit(T)
-        
-        #Calculate synthetic samples
-        for i in xrange(n_minority_samples):
-            nn = neigh.kneighbors(T[i], return_distance=False)
-            for n in xrange(N):
-                nn_index = random.choice(nn[0])
-                #NOTE: nn includes T[i], we don't want to select it 
-                while nn_index == i:
-                    nn_index = random.choice(nn[0])
-                    
-                dif = T[nn_index] - T[i]
-                gap = np.random.uniform(low = 0.0, high = h)
-                S[n + i * N, :] = T[i,:] + gap * dif[:]
-        
-        return S
+        --------
+        list
+            A predictions.FoldPredictions object per model, in the same order as models
+        """
+        modelParams = modelParams or {}
+        specs = [(model, None, _frozen(modelParams.get(model)), None) for model in models]
+        return self._crossValidate(specs, self.dataset, None, nFolds, doSubsampling, subRate, doSMOTE, pctSMOTE,
+                                   smoteAlgorithm, seed, cacheDir, nJobs)
+
+
+    def _crossValidate(self, specs, X, columns, nFolds, doSubsampling, subRate, doSMOTE, pctSMOTE,
+                            smoteAlgorithm, seed, cacheDir, nJobs):
+        """ Cross validate (model, nColumns, params, budget) specs on a shared fold plan
+
+        X is either self.dataset or a copy of it with columns reordered as given by
+        columns, and each spec trains on the first nColumns columns of X (all of them
+        when nColumns is None), with params (a tuple of items or None) overriding the
+        parameters set in clfs, and on a stratified fraction budget of every training
+        fold (all of it when budget is None). Subsets of the same fold are nested, the
+        smaller fractions being part of the larger ones. A budget can also be a
+        (parameter, fraction) pair, marking a partial run whose params were already
+        scaled down, e.g. ('n_estimators', 1/9.), which trains on the whole folds. See
+        crossValidateModels for the other parameters. Specs with a budget are part of
+        a search and are never persisted to cacheDir.
+        """
+        variants = ('base', 'smote') if doSMOTE else ('base',)
+        results = {}; pending = []
+
+        for spec in specs:
+            model, nColumns, params, budget = spec
+            setup = dict(nFolds=nFolds, seed=seed, subRate=subRate if doSubsampling else None,
+                         pctSMOTE=pctSMOTE if doSMOTE else None,
+                         smoteAlgorithm=smoteAlgorithm if doSMOTE else None, planVersion=resampling.PLAN_VERSION)
+            if nColumns is not None:
+                setup['columns'] = tuple(columns[:nColumns]) if columns is not None else nColumns
+            if budget is not None:
+                setup['budget'] = budget
+            key = predictions.predictionKey(model, estimator(model, params), self.datasetHash(), **setup)
+            path = None
+            if cacheDir is not None and seed is not None and budget is None:
+                # Partial budget results are only needed for the rung of a search
+                path = os.path.join(cacheDir, key + '.npz')
+                if key not in self.predictions and os.path.exists(path):
+                    self.predictions[key] = predictions.FoldPredictions.load(path)
+            if key in self.predictions:
+                results[spec] = self.predictions[key]
+            elif spec not in results:
+                results[spec] = predictions.FoldPredictions(key, len(self.labels), variants)
+                pending.append((spec, path))
+
+        if pending:
+            # Generate indexes for the K-fold setup, shared by all models
+            plan = self.foldPlan(nFolds, seed, subRate if doSubsampling else None)
+            folds = list(plan)
+
+            # Split the core budget between concurrent tasks and the estimators they train
+            nTasks = len(pending) * len(folds) * len(variants)
+            nThreads = max(1, scheduler.coreBudget(nJobs) // max(1, min(scheduler.coreBudget(nJobs), nTasks)))
+            tasks = []
+            for spec, path in pending:
+                model, nColumns, params, budget = spec
+                clf = self._withBins(estimator(model, params), columns)
+                if nJobs is not None:
+                    clf = scheduler.limitThreads(clf, nThreads)
+                for i, (train, test) in enumerate(folds):
+                    if budget is not None and not isinstance(budget, tuple):
+                        train = resampling.nestedSubset(self.labels, train, budget, plan.seeds[i])
+                    for variant in variants:
+                        tasks.append(((spec, i, variant),
+                                      (clf, train, test, pctSMOTE if variant == 'smote' else None, smoteAlgorithm,
+                                       nColumns, plan.seeds[i], instrument.profilePath(model, i, variant))))
+
+            start = time.time()
+            with instrument.span('crossValidate', tasks=nTasks, rows=X.shape[0], features=X.shape[1], nJobs=nJobs), \
+                    resampling.workspace():
+                for (spec, i, variant), (prob, pred), seconds, pid in scheduler.runTasks(foldTask, tasks, X, self.labels, nJobs):
+                    results[spec].record(variant, i, folds[i][1], prob, pred, seconds)
+
+            if nJobs is not None:
+                logger.info('Ran %d tasks on %d cores in %.2fs', nTasks, scheduler.coreBudget(nJobs), time.time() - start)
+                logger.info('%-8s %-8s %-8s %-12s %-12s', 'Model', 'Columns', 'Variant', 'Mean fit (s)', 'Max fit (s)')
+                for spec, path in pending:
+                    model, nColumns = spec[:2]
+                    for variant in variants:
+                        seconds = results[spec].seconds[variant]
+                        logger.info('%-8s %-8s %-8s %-12.3f %-12.3f', model, nColumns or X.shape[1], variant,
+                                    seconds.mean(), seconds.max())
+
+            for spec, path in pending:
+                if path is not None:
+                    results[spec].save(path)
+                self.predictions[results[spec].key] = results[spec]
+
+        return [results[spec] for spec in specs]
+
+
+    def gradeView(self, families=GRADE_FAMILIES):
+        """ The processed dataset with its columns ordered by grade
+
+        The grade-by-grade features carry the number of the grade block as a suffix
+        (absrate1 for grade 6, absrate2 for grade 7 and so on). Columns are stably
+        sorted by block, features outside of families last, so that the features
+        available up to any grade are a leading column slice. The dataset is not
+        copied when its columns already are in that order.
+
+        Parameters
+        ----------
+        families : list
+            The names of the grade-by-grade feature families
+
+        Returns
+        --------
+        (np.ndarray or scipy.sparse matrix, np.ndarray, dict)
+            The reordered dataset, the processed column of each of its columns, and the
+            number of leading columns holding the features up to every grade found
+        """
+        if self.featureSources is None:
+            raise ValueError('Grade views need the original features, build the Model with doPCA=False')
+
+        # Grade block of every processed feature, features outside of the families last
+        pattern = re.compile(r'^(' + '|'.join(re.escape(f) for f in families) + r')(\d+)$')
+        blocks = np.array([int(pattern.match(c).group(2)) if pattern.match(c) else np.iinfo(np.int32).max
+                           for c in self.featureSources])
+        columns = np.argsort(blocks, kind='mergesort')
+        X = self.dataset
+        if (columns != np.arange(len(columns))).any():
+            X = X[:, columns]
+        blocks = blocks[columns]
+
+        found = sorted(set(FIRST_GRADE - 1 + b for b in blocks if b != np.iinfo(np.int32).max))
+        cutoffs = dict((g, int(np.searchsorted(blocks, g - FIRST_GRADE + 1, side='right'))) for g in found)
+        return X, columns, cutoffs
+
+
+    def sweepGrades(self, models=['LR'], grades=None, families=GRADE_FAMILIES, topK=.1, nFolds=10,
+                            doSubsampling=False, subRate=1.0, doSMOTE=False, pctSMOTE=100,
+                            smoteAlgorithm='auto', seed=None, cacheDir=None, nJobs=None, modelParams=None):
+        """ Precision at top K for models trained on data up to each grade
+
+        The grade-by-grade features carry the number of the grade block as a suffix
+        (absrate1 for grade 6, absrate2 for grade 7 and so on). For every cutoff grade,
+        each model is cross validated using only the features of the grades up to the
+        cutoff, which tells how early at-risk students can be identified.
+
+        The processed dataset is reused as is: its columns are ordered by grade once
+        (no copy at all when they already are), and each cutoff trains on a column
+        slice of it. All cutoffs and models share one fold plan and run together,
+        in parallel when nJobs is given. Feature selection, when enabled in the
+        constructor, was done on all grades; build the Model with
+        doFeatureSelection=False to avoid that. Features outside of families are
+        left out of the sweep.
+
+        Parameters
+        ----------
+        models : list
+            A list of classifiers to evaluate given by the 2-3 letter codes above
+        grades : list or None
+            The cutoff grades to evaluate, e.g. [6, 7, 8]; all grades found by default
+        families : list
+            The names of the grade-by-grade feature families
+        topK : float
+            The fraction of students at highest risk the precision is computed on
+        nFolds, doSubsampling, subRate, doSMOTE, pctSMOTE, smoteAlgorithm, seed, cacheDir, nJobs, modelParams :
+            See crossValidateModels
+
+        Returns
+        --------
+        pd.DataFrame
+            The precision at top K of every model (columns) for every cutoff grade (rows)
+        """
+        X, columns, cutoffs = self.gradeView(families)
+        grades = sorted(cutoffs) if grades is None else [g for g in grades if g in cutoffs]
+        if not grades:
+            raise ValueError('No grade-by-grade features found among ' + ', '.join(families))
+        widths = [cutoffs[g] for g in grades]
+
+        modelParams = modelParams or {}
+        specs = [(model, width, _frozen(modelParams.get(model)), None) for width in widths for model in models]
+        results = self._crossValidate(specs, X, columns, nFolds, doSubsampling, subRate, doSMOTE, pctSMOTE,
+                                      smoteAlgorithm, seed, cacheDir, nJobs)
+
+        # Tabulate precision at top K for every cutoff, model and variant
+        table = pd.DataFrame(index=pd.Index(grades, name='grade'))
+        for j, (model, width, params, budget) in enumerate(specs):
+            for variant in results[j].variants:
+                label = model + (' SMOTE' if variant == 'smote' else '')
+                precision = metrics.precisionAtK(self.labels, results[j].prob[variant], topK)
+                table.loc[grades[widths.index(width)], label] = precision
+
+        print 'Precision at top ' + str(100*topK) + '% by cutoff grade'
+        print '%-8s' % 'Grade' + ''.join('%-12s' % c for c in table.columns)
+        for grade, row in table.iterrows():
+            print '%-8d' % grade + ''.join('%-12.3f' % v for v in row)
+        print '\n'
+        return table
+
+
+    def fitPipeline(self, model='LR', doSubsampling=False, subRate=1.0, doSMOTE=False, pctSMOTE=100,
+                            smoteAlgorithm='auto', seed=None, modelParams=None):
+        """ Train a classifier on every student and bundle it with the preprocessing
+
+        The resulting pipeline applies the encoding, feature selection, scaling and PCA
+        fitted by this object to new student records, so new cohorts can be scored
+        without retraining, e.g. chunk by chunk with ingest.scoreFile.
+
+        Parameters
+        ----------
+        model : string
+            The 2-3 letter code of the classifier to train
+        doSubsampling : bool
+            Boolean value to determine whether to subsample the majority class
+        subRate : float
+            The ratio majority/minority to keep for training
+        doSMOTE : bool
+            Boolean value to determine whether or not to run SMOTE on the training set
+        pctSMOTE : int
+            The oversampling percentage to be used by SMOTE
+        smoteAlgorithm : string
+            The nearest neighbour backend used by SMOTE
+        seed : int or None
+            Seed of the subsampling and SMOTE
+        modelParams : dict or None
+            Parameters overriding those set in clfs, by model code
+
+        Returns
+        --------
+        pipeline.RiskPipeline
+            The fitted pipeline
+        """
+        rs = resampling.randomState(seed)
+        train = np.arange(len(self.labels))
+        if doSubsampling:
+            train = self.subsample(self.dataset, self.labels, train, subRate, rs)
+        X_train, y_train = trainingSet(self.dataset, self.labels, train,
+                                       pctSMOTE if doSMOTE else None, smoteAlgorithm, rs)
+        clf = self._withBins(clone(estimator(model, (modelParams or {}).get(model))))
+        denseInput = isinstance(clf, DENSE_ONLY)
+        if denseInput and sp.issparse(X_train):
+            X_train = X_train.toarray()
+        clf.fit(X_train, y_train)
+        return pipeline.RiskPipeline(model, self.encoder, self.featureMask, self.scaler, self.pca, clf, denseInput)
 
 
     def runClassification(self, outputFormat='score', doSubsampling=False, subRate=1.0,
-                            doSMOTE=False, pctSMOTE=100, nFolds=10, models=['LR'], topK=.1,):
+                            doSMOTE=False, pctSMOTE=100, nFolds=10, models=['LR'], topK=.1, smoteAlgorithm='auto',
+                            seed=None, cacheDir=None, nJobs=None, groupBy=None, perGroup=None, riskFile=None,
+                            nBoot=2000, modelParams=None):
         """ Main function to train and evaluate model
 
         Allows user to set the type of output and a few other parameters to running a K-fold
-        cross validation experiment.        
+        cross validation experiment. Each model is cross validated once through crossValidate
+        and every output format is rendered from those out-of-fold results.
 
         Parameters
         ----------
         outputFormat :  string
-            The desired output format. Choices are: 'score', 'summary', 'matrix', 'roc', 'prc', 'topk' and 'risk'
+            The desired output format. Choices are: 'score', 'summary', 'matrix', 'roc', 'prc', 'topk', 'risk'
+            and 'metrics'
         doSubsampling : bool
             Boolean value to determine whether to subsample the majority class
         subRate : float
@@ -236,123 +682,107 @@ class Model:
             The number of folds to be assigned to the K-fold process    
         models : list
             A list of classifiers to evaluate given by the 2-3 letter codes above
-	printFeatureImportance : bool (default False)
-	    Boolean value to determine whether to print RF generated feature importances
+        topK : float
+            The fraction of students at highest risk considered by 'topk', 'risk' and 'metrics'
+        smoteAlgorithm : string
+            The nearest neighbour backend used by SMOTE: 'auto', 'brute', 'kd_tree' or 'ball_tree'
+        seed : int or None
+            Seed for the fold assignment
+        cacheDir : string or None
+            A directory where out-of-fold results are persisted, so that reruns with
+            another output format or topK do not retrain the models
+        nBoot : int
+            The number of bootstrap resamples behind the confidence intervals of 'metrics'
+        modelParams : dict or None
+            Parameters overriding those set in clfs, by model code, e.g. the best
+            parameters found by search.successiveHalving
         
         Returns
         --------
             Results are displayed inline for now
             
         """
+        if outputFormat not in OUTPUT_FORMATS:
+            raise ValueError("outputFormat must be one of " + ', '.join(OUTPUT_FORMATS))
 
-        # Return a simple overall accuracy score
-        if outputFormat=='score':
-            if doSMOTE or doSubsampling:
-                print 'Sorry, scoring with subsampling or SMOTE not yet implemented'
-                return
-            # Iterate through each classifier to be evaluated
-            for ix,clf in enumerate([clfs[x] for x in models]):
-                kf = cross_validation.KFold(len(self.dataset), nFolds, shuffle=True)
-                scores = cross_validation.cross_val_score(clf, self.dataset, self.labels, cv=kf)
-                print models[ix]+ ' Accuracy: %.2f' % np.mean(scores)
-        
-        # Return a summary table describing several metrics or a confusion matrix 
-        elif outputFormat=='summary' or outputFormat=='matrix':
-            for ix,clf in enumerate([clfs[x] for x in models]):
-                # Store the prediction results and their corresponding real labels for each fold
-                y_prediction_results = []; y_smote_prediction_results = []
-                y_original_values = []
-                
-                # Generate indexes for the K-fold setup
-                kf = cross_validation.StratifiedKFold(self.labels, n_folds=nFolds)
-                for i, (train, test) in enumerate(kf):
-                    if doSubsampling:
-                    	# Remove some random majority class instances to balance data
-                        train = self.subsample(self.dataset,self.labels,train,subRate)
-                    if doSMOTE:
-                        # SMOTE the minority class and append new instances to training set 
-                        minority = self.dataset[train][np.where(self.labels[train]==1)]
-                        smotted = self.SMOTE(minority, pctSMOTE, 5)
-                        X_train_smote = np.vstack((self.dataset[train],smotted))
-                        y_train_smote = np.append(self.labels[train],np.ones(len(smotted),dtype=np.int32))
-                        # Fit the new training set to selected model
-                        y_pred_smote = clf.fit(X_train_smote, y_train_smote).predict(self.dataset[test])
-                        # Generate SMOTEd predictions and append that to the rersults list 
-                        y_smote_prediction_results = np.concatenate((y_smote_prediction_results,y_pred_smote),axis=0)
-                        
-                    # Generate predictions for current hold-out sample in i-th fold
-		    fitted_clf = clf.fit(self.dataset[train], self.labels[train])
-		    # self.feature_importances = getattr(fitted_clf, 'feature_importances_', None)
-                    y_pred = fitted_clf.predict(self.dataset[test])
-                    # Append results to previous ones
-                    y_prediction_results = np.concatenate((y_prediction_results,y_pred),axis=0)
-                    # Store the corresponding original values for the predictions just generated
-                    y_original_values = np.concatenate((y_original_values,self.labels[test]),axis=0)
-                
-                # Print result summary table based on k-fold 
-                # This is specific to our particular experiment and classes are hard coded
-                # When oversampling is True, both results are displayed
-                if outputFormat=='summary':
-                    print '\t\t\t\t\t\t'+models[ix]+ ' Summary Results'
-                    cm = classification_report(y_original_values, y_prediction_results,target_names=['Graduated','Did NOT Graduate'])
+        allResults = dict(zip(models, self.crossValidateModels(models, nFolds=nFolds, doSubsampling=doSubsampling,
+                                                                subRate=subRate, doSMOTE=doSMOTE, pctSMOTE=pctSMOTE,
+                                                                smoteAlgorithm=smoteAlgorithm, seed=seed,
+                                                                cacheDir=cacheDir, nJobs=nJobs,
+                                                                modelParams=modelParams)))
+        # Align grouping keys with the processed students
+        groups = None
+        if groupBy is not None:
+            groups = groupBy.reindex(self.students)
+            if not isinstance(groups, pd.DataFrame):
+                groups = groups.to_frame(groups.name or 'group')
+        rankedTables = []
+
+        for model in models:
+            results = allResults[model]
+            y_original_values = self.labels
+            folds = results.folds
+
+            # Return a simple overall accuracy score, averaged over the folds
+            if outputFormat=='score':
+                for variant in results.variants:
+                    correct = (results.pred[variant] == y_original_values).astype(float)
+                    scores = np.bincount(folds, weights=correct) / np.bincount(folds)
+                    label = ' SMOTE' if variant == 'smote' else ''
+                    print model + label + ' Accuracy: %.2f' % np.mean(scores)
+
+            # Print result summary table based on k-fold 
+            # This is specific to our particular experiment and classes are hard coded
+            # When oversampling is True, both results are displayed
+            elif outputFormat=='summary':
+                print '\t\t\t\t\t\t'+model+ ' Summary Results'
+                cm = metrics.report(metrics.confusion(y_original_values, results.pred['base']),['Graduated','Did NOT Graduate'])
+                print(str(cm)+'\n')
+                if doSMOTE:
+                    print '\t\t\t\t\t\t'+model+ ' SMOTE Summary Results'
+                    cm = metrics.report(metrics.confusion(y_original_values, results.pred['smote']),['Graduated','Did NOT Graduate'])
                     print(str(cm)+'\n')
-                    if doSMOTE:
-                        print '\t\t\t\t\t\t'+models[ix]+ ' SMOTE Summary Results'
-                        cm = classification_report(y_original_values, y_smote_prediction_results,target_names=['Graduated','Did NOT Graduate'])
-                        print(str(cm)+'\n')
-                    print '----------------------------------------------------------\n'
-                
-                # Print the confusion matrix
-                else:
-                    print '\t\t\t\t\t'+models[ix]+ ' Confusion Matrix'
+                print '----------------------------------------------------------\n'
+
+            # Print the confusion matrix
+            elif outputFormat=='matrix':
+                print '\t\t\t\t\t'+model+ ' Confusion Matrix'
+                print '\t\t\t\tGraduated\tDid NOT Graduate'
+                cm = metrics.confusion(y_original_values, results.pred['base'])
+                print 'Graduated\t\t\t%d\t\t%d'% (cm[0][0],cm[0][1])
+                print 'Did NOT Graduate\t%d\t\t%d'% (cm[1][0],cm[1][1])
+                if doSMOTE:
+                    print '\n\t\t\t\t'+model+ ' SMOTE Confusion Matrix'
                     print '\t\t\t\tGraduated\tDid NOT Graduate'
-                    cm = confusion_matrix(y_original_values, y_prediction_results)
+                    cm = metrics.confusion(y_original_values, results.pred['smote'])
                     print 'Graduated\t\t\t%d\t\t%d'% (cm[0][0],cm[0][1])
                     print 'Did NOT Graduate\t%d\t\t%d'% (cm[1][0],cm[1][1])
-                    if doSMOTE:
-                        print '\n\t\t\t\t'+models[ix]+ ' SMOTE Confusion Matrix'
-                        print '\t\t\t\tGraduated\tDid NOT Graduate'
-                        cm = confusion_matrix(y_original_values, y_smote_prediction_results)
-                        print 'Graduated\t\t\t%d\t\t%d'% (cm[0][0],cm[0][1])
-                        print 'Did NOT Graduate\t%d\t\t%d'% (cm[1][0],cm[1][1])
-                        
-                    print '----------------------------------------------------------\n'
-                
-        # Generate ROC curves 
-        # The majority of the structure here is similar to above, so refer to early comments
-        # TODO: create consise procedures to avoid code duplication
-        elif outputFormat=='roc':
-            for ix,clf in enumerate([clfs[x] for x in models]):
-                kf = cross_validation.StratifiedKFold(self.labels, n_folds=nFolds)
+                print '----------------------------------------------------------\n'
+
+            # Generate ROC curves averaged over the folds
+            elif outputFormat=='roc':
+                import matplotlib.pylab as pl
                 mean_tpr = mean_smote_tpr = 0.0
                 mean_fpr = mean_smote_fpr = np.linspace(0, 1, 100)
-                
-                for i, (train, test) in enumerate(kf):
-                    if doSubsampling:
-                        train = self.subsample(self.dataset,self.labels,train,subRate)
-                    if doSMOTE:
-                        minority = self.dataset[train][np.where(self.labels[train]==1)]
-                        smotted = self.SMOTE(minority, pctSMOTE, 5)
-                        X_train = np.vstack((self.dataset[train],smotted))
-                        y_train = np.append(self.labels[train],np.ones(len(smotted),dtype=np.int32))
-                        probas2_ = clf.fit(X_train, y_train).predict_proba(self.dataset[test])
-                        fpr, tpr, thresholds = roc_curve(self.labels[test], probas2_[:, 1])
-                        mean_smote_tpr += np.interp(mean_smote_fpr, fpr, tpr)
-                        mean_smote_tpr[0] = 0.0
 
-                    # Generate "probabilities" for the current hold out sample being predicted
-		    fitted_clf = clf.fit(self.dataset[train], self.labels[train])
-		    # self.feature_importances = getattr(fitted_clf, 'feature_importances_', None)
-                    probas_ = fitted_clf.predict_proba(self.dataset[test])
+                # Sort the scores once and split the sorted scores by fold
+                curves = metrics.Curve(y_original_values, results.prob['base']).split(folds)
+                if doSMOTE:
+                    smote_curves = metrics.Curve(y_original_values, results.prob['smote']).split(folds)
+                for i in xrange(results.nFolds):
                     # Compute ROC curve and area the curve
-                    fpr, tpr, thresholds = roc_curve(self.labels[test], probas_[:, 1])
+                    fpr, tpr, thresholds = curves[i].roc()
                     mean_tpr += np.interp(mean_fpr, fpr, tpr)
+                    if doSMOTE:
+                        fpr, tpr, thresholds = smote_curves[i].roc()
+                        mean_smote_tpr += np.interp(mean_smote_fpr, fpr, tpr)
+                        mean_smote_tpr[0] = 0.0
 
                 # Plot ROC baseline
                 pl.plot([0, 1], [0, 1], '--', color=(0.6, 0.6, 0.6), label='Baseline')
 
                 # Compute true positive rates
-                mean_tpr /= len(kf)
+                mean_tpr /= results.nFolds
                 mean_tpr[-1] = 1.0
                 mean_auc = auc(mean_fpr, mean_tpr)
 
@@ -362,7 +792,7 @@ class Model:
                         
                 # Plot results with oversampling
                 if doSMOTE:
-                    mean_smote_tpr /= len(kf)
+                    mean_smote_tpr /= results.nFolds
                     mean_smote_tpr[-1] = 1.0
                     mean_smote_auc = auc(mean_smote_fpr, mean_smote_tpr)
                     pl.plot(mean_smote_fpr, mean_smote_tpr, 'r-',
@@ -372,95 +802,291 @@ class Model:
                 pl.ylim([-0.05, 1.05])
                 pl.xlabel('False Positive Rate')
                 pl.ylabel('True Positive Rate')
-                pl.title(models[ix]+ ' ROC')
+                pl.title(model+ ' ROC')
                 pl.legend(loc="lower right")
                 pl.show()
-                
-        # Generate Precision-Recall curves, topK precision, or list of topK at risk scores
-        elif outputFormat =='prc' or outputFormat =='topk' or outputFormat =='risk':
-            for ix,clf in enumerate([clfs[x] for x in models]):
-                y_prob = []; y_smote_prob = []
-                y_prediction_results = []; y_smote_prediction_results = []
-                y_original_values = []; test_indexes = []
-            
-                kf = cross_validation.StratifiedKFold(self.labels, n_folds=nFolds, shuffle=True)
-                mean_pr = mean_smote_pr = 0.0
-                mean_rc = mean_smote_rc = np.linspace(0, 1, 100)
-                
-                for i, (train, test) in enumerate(kf):
-                    if doSubsampling:
-                        train = self.subsample(self.dataset,self.labels,train,subRate)
-                        
-                    if doSMOTE:
-                        clf2 = clf
-                        minority = self.dataset[train][np.where(self.labels[train]==1)]
-                        smotted = self.SMOTE(minority, pctSMOTE, 5)
-                        X_train = np.vstack((self.dataset[train],smotted))
-                        y_train = np.append(self.labels[train],np.ones(len(smotted),dtype=np.int32))
-                        clf2.fit(X_train, y_train)
-                        probas2_ = clf2.predict_proba(self.dataset[test])
-                        y_pred_smote = clf2.predict(self.dataset[test])
-                        # Generate SMOTEd predictions and append that to the rersults list 
-                        y_smote_prediction_results = np.concatenate((y_smote_prediction_results,y_pred_smote),axis=0)
-                        y_smote_prob = np.concatenate((y_smote_prob,probas2_[:, 1]),axis=0)
-
-                    clf.fit(self.dataset[train], self.labels[train])
-                    y_pred = clf.predict(self.dataset[test])
-                    y_prediction_results = np.concatenate((y_prediction_results,y_pred),axis=0)
-                    test_indexes = np.concatenate((test_indexes,test),axis=0)
-                    y_original_values = np.concatenate((y_original_values,self.labels[test]),axis=0)
-                    probas_ = clf.predict_proba(self.dataset[test])
-                    y_prob = np.concatenate((y_prob,probas_[:, 1]),axis=0)
-                    
+
+            # Output the precision recall curve
+            elif outputFormat=='prc':
+                import matplotlib.pylab as pl
                 # Compute overall prediction, recall and area under PR-curve
-                precision, recall, thresholds = precision_recall_curve(y_original_values, y_prob)
+                precision, recall, thresholds = metrics.Curve(y_original_values, results.prob['base']).pr()
                 pr_auc = auc(recall, precision)
-                
-                        
+                pl.plot(recall, precision, color = 'b', label='Precision-Recall curve (area = %0.2f)' % pr_auc)
                 if doSMOTE:
-                    precision_smote, recall_smote, thresholds_smote = precision_recall_curve(y_original_values, y_smote_prob)
+                    precision_smote, recall_smote, thresholds_smote = metrics.Curve(y_original_values, results.prob['smote']).pr()
                     pr_auc_smote = auc(recall_smote, precision_smote)
+                    pl.plot(recall_smote, precision_smote, color = 'r', label='SMOTE Precision-Recall curve (area = %0.2f)' % pr_auc_smote)
+                pl.xlim([-0.05, 1.05])
+                pl.ylim([-0.05, 1.05])
+                pl.xlabel('Recall')
+                pl.ylabel('Precision')
+                pl.title(model+ ' Precision-Recall')
+                pl.legend(loc="lower right")
+                pl.show()
 
-                # Output the precision recall curve
-                if outputFormat=='prc':
-                    pl.plot(recall, precision, color = 'b', label='Precision-Recall curve (area = %0.2f)' % pr_auc)
-                    if doSMOTE:
-                        pl.plot(recall_smote, precision_smote, color = 'r', label='SMOTE Precision-Recall curve (area = %0.2f)' % pr_auc_smote)
-                    pl.xlim([-0.05, 1.05])
-                    pl.ylim([-0.05, 1.05])
-                    pl.xlabel('Recall')
-                    pl.ylabel('Precision')
-                    pl.title(models[ix]+ ' Precision-Recall')
-                    pl.legend(loc="lower right")
-                    pl.show()
-                    
-                # Output a list of the topK% students at highest risk along with their risk scores
-                elif outputFormat =='risk':
-                    test_indexes = test_indexes.astype(int)
-                    sort_ix = np.argsort(test_indexes)
-                    students_by_risk = self.students[test_indexes]
-                    y_prob = ((y_prob[sort_ix])*100).astype(int)
-                    probas = np.column_stack((students_by_risk,y_prob))
-                    r = int(topK*len(y_original_values))
-                    print models[ix]+ ' top ' + str(100*topK) + '%' + ' highest risk'
-                    print '--------------------------'
-                    print '%-15s %-10s' % ('Student','Risk Score')
-                    print '%-15s %-10s' % ('-------','----------')
-                    probas = probas[np.argsort(probas[:, 1])[::-1]]
-                    for i in range(r):
-                        print '%-15s %-10d' % (probas[i][0], probas[i][1])
-                    print '\n'
-                
-                # Output the precision on the topK%   
+            # Output a list of the topK% students at highest risk along with their risk scores
+            elif outputFormat =='risk':
+                if groups is None:
+                    table = ranking.rank(self.students, results.prob['base'], n=ranking.topCount(topK, len(y_original_values)))
+                    print model+ ' top ' + str(100*topK) + '%' + ' highest risk'
                 else:
-                    ord_prob = np.argsort(y_prob,)[::-1] 
-                    r = int(topK*len(y_original_values))
-                    print models[ix]+ ' Precision at top ' + str(100*topK) + '%'
-                    print np.sum(y_original_values[ord_prob][:r])/r
+                    table = ranking.rank(self.students, results.prob['base'], n=perGroup, fraction=topK, groups=groups)
+                    quota = str(perGroup) if perGroup is not None else str(100*topK) + '%'
+                    print model+ ' top ' + quota + ' highest risk per ' + ', '.join(groups.columns)
+                keys = list(table.columns[3:])
+                print '--------------------------'
+                print ''.join('%-15s ' % k for k in keys) + '%-15s %-10s' % ('Student','Risk Score')
+                print ''.join('%-15s ' % ('-' * len(k)) for k in keys) + '%-15s %-10s' % ('-------','----------')
+                for row in table.itertuples(index=False):
+                    print ''.join('%-15s ' % v for v in row[3:]) + '%-15s %-10d' % (row[0], int(row[1]*100))
+                print '\n'
+                if riskFile is not None:
+                    table.insert(0, 'model', model)
+                    rankedTables.append(table)
 
-                    if doSMOTE:
-                        ord_prob = np.argsort(y_smote_prob,)[::-1] 
-                        print models[ix]+ ' SMOTE Precision at top ' + str(100*topK) + '%'
-                        print np.sum(y_original_values[ord_prob][:r])/r
+            # Output precision and recall over a grid of top K, with bootstrap confidence
+            # intervals for precision at topK and AUC
+            elif outputFormat=='metrics':
+                for variant in results.variants:
+                    label = ' SMOTE' if variant == 'smote' else ''
+                    curve = metrics.Curve(y_original_values, results.prob[variant])
+                    grid = curve.atK(TOPK_GRID)
+                    print model + label + ' Precision and recall at top K'
+                    print '%-8s %-8s %-10s %-10s' % ('Top', 'K', 'Precision', 'Recall')
+                    for top, row in grid.iterrows():
+                        print '%-8s %-8d %-10.3f %-10.3f' % (str(100*top) + '%', row['k'], row['precision'], row['recall'])
+                    ci = metrics.bootstrap(y_original_values, results.prob[variant], topK=topK, nBoot=nBoot,
+                                           seed=seed, curve=curve)
+                    print '%d bootstrap resamples, 95%% confidence intervals' % nBoot
+                    print 'Precision at top %s%%: %.3f [%.3f, %.3f]' % ((str(100*topK),) + tuple(ci.loc['precision']))
+                    print 'AUC: %.3f [%.3f, %.3f]' % tuple(ci.loc['auc'])
                     print '\n'
 
+            # Output the precision on the topK%   
+            else:
+                for variant in results.variants:
+                    label = ' SMOTE' if variant == 'smote' else ''
+                    print model+ label + ' Precision at top ' + str(100*topK) + '%'
+                    print metrics.precisionAtK(y_original_values, results.prob[variant], topK)
+                print '\n'
+
+        if rankedTables:
+            ranking.writeTable(pd.concat(rankedTables, ignore_index=True), riskFile)
+
+
+#############################################################
+# SMOTE implementation by Karsten Jeschkies                 #
+# The MIT License (MIT)                                     #
+# Copyright (c) 2012-2013 Karsten Jeschkies <jeskar@web.de> # 
+#                                                           #
+# This is an implementation of the SMOTE Algorithm.         #
+# See: "SMOTE: synthetic minority over-sampling technique"  #
+# by Chawla, N.V et al.                                     #
+#############################################################
+
+def smote(T, N, k, h = 1.0, algorithm='auto', random_state=None, batchSize=None):
+    """ Synthetic minority oversampling.
+
+    Returns (N/100) * n_minority_samples synthetic minority samples. All neighbour
+    lookups are done in a few batched queries and the synthetic samples are built
+    in a single vectorized step.
+
+    Parameters
+    ----------
+    T : array-like, shape = [n_minority_samples, n_features]
+        Holds the minority samples
+    N : percetange of new synthetic samples: 
+        n_synthetic_samples = N/100 * n_minority_samples. Can be < 100.
+    k : int. Number of nearest neighbours. 
+    h : float
+        Upper bound of the interpolation gap between a sample and its neighbour
+    algorithm : string
+        The neighbour search backend: 'brute', 'kd_tree' or 'ball_tree', or 'auto'
+        for brute force on small or wide minority sets and a k-d tree otherwise, see
+        SMOTE_BRUTE_ROWS
+    random_state : int, np.random.RandomState or None
+        Seed or generator used to draw neighbours and gaps
+    batchSize : int
+        The number of minority samples queried for neighbours at once. By default
+        it is chosen so that a brute force query block stays around 128MB
+
+    Returns
+    -------
+    S : Synthetic samples. array, 
+        shape = [(N/100) * n_minority_samples, n_features]. 
+    """    
+    if isinstance(random_state, np.random.RandomState):
+        rng = random_state
+    else:
+        rng = np.random.RandomState(random_state)
+
+    T = T.toarray() if sp.issparse(T) else np.asarray(T)
+    n_minority_samples, n_features = T.shape
+
+    if N < 100:
+        # Create synthetic samples only for a random subset of T
+        base = np.sort(rng.choice(n_minority_samples, int(N/100.0 * n_minority_samples), replace=False))
+        N = 100
+    else:
+        base = np.arange(n_minority_samples)
+
+    if (N % 100) != 0:
+        raise ValueError("N must be < 100 or multiple of 100")
+
+    N = int(N/100)
+    n_base = len(base)
+    if n_base == 0 or n_minority_samples < 2:
+        return np.zeros(shape=(0, n_features), dtype=T.dtype)
+
+    # Learn nearest neighbours
+    k = min(max(k, 2), n_minority_samples)
+    if algorithm == 'auto':
+        small = n_minority_samples <= SMOTE_BRUTE_ROWS or n_features > SMOTE_TREE_FEATURES
+        algorithm = 'brute' if small else 'kd_tree'
+    neigh = NearestNeighbors(n_neighbors=k, algorithm=algorithm)
+    neigh.fit(T)
+
+    # Query the neighbourhoods of all base samples in batches
+    if batchSize is None:
+        batchSize = max(1, 2**24 // n_minority_samples)
+    nn = np.empty((n_base, k), dtype=np.intp)
+    for start in xrange(0, n_base, batchSize):
+        stop = min(start + batchSize, n_base)
+        nn[start:stop] = neigh.kneighbors(T[base[start:stop]], return_distance=False)
+
+    # nn usually includes the sample itself, which we don't want to select:
+    # draw among the remaining candidates and shift picks past its position
+    is_self = nn == base[:, np.newaxis]
+    has_self = is_self.any(axis=1)
+    self_pos = np.where(has_self, is_self.argmax(axis=1), k)
+    n_candidates = k - has_self
+    picks = (rng.random_sample((n_base, N)) * n_candidates[:, np.newaxis]).astype(np.intp)
+    picks += picks >= self_pos[:, np.newaxis]
+    nn_index = nn[np.arange(n_base)[:, np.newaxis], picks]
+
+    # Calculate synthetic samples
+    gap = rng.uniform(low=0.0, high=h, size=(n_base, N, 1))
+    origin = T[base][:, np.newaxis, :]
+    S = origin + gap * (T[nn_index] - origin)
+
+    return S.reshape(n_base * N, n_features)
+
+
+def fitPredict(clf, X_train, y_train, X_test):
+    """ Fit a classifier and predict a hold-out set
+
+    Sparse data is densified for classifiers listed in DENSE_ONLY.
+
+    Parameters
+    ----------
+    clf : sklearn estimator
+        The classifier to be trained
+    X_train : np.ndarray
+        The training instances
+    y_train : np.ndarray
+        The training labels
+    X_test : np.ndarray
+        The hold-out instances
+
+    Returns
+    --------
+    (np.ndarray, np.ndarray)
+        The predicted probability of the positive class and the predicted class
+        for each hold-out instance
+    """
+    if sp.issparse(X_train) and isinstance(clf, DENSE_ONLY):
+        X_train = X_train.toarray(); X_test = X_test.toarray()
+    estimator = type(clf).__name__
+    with instrument.span('fit', estimator=estimator, rows=X_train.shape[0], features=X_train.shape[1]):
+        clf.fit(X_train, y_train)
+    with instrument.span('predict', estimator=estimator, rows=X_test.shape[0], features=X_test.shape[1]):
+        return clf.predict_proba(X_test)[:, 1], clf.predict(X_test)
+
+
+def foldTask(X, y, clf, train, test, pctSMOTE=None, smoteAlgorithm='auto', nColumns=None, seed=None,
+             profilePath=None):
+    """ Train and evaluate one classifier on one cross validation fold
+
+    This is the unit of work handed to scheduler.runTasks by crossValidateModels.
+
+    Parameters
+    ----------
+    X : np.ndarray
+        The entire dataset
+    y : np.ndarray
+        The labels
+    clf : sklearn estimator
+        The classifier to be trained
+    train : np.ndarray
+        The array indexes of the training instances
+    test : np.ndarray
+        The array indexes of the hold-out instances
+    pctSMOTE : int or None
+        When given, the training set is extended with SMOTEd minority instances
+    smoteAlgorithm : string
+        The nearest neighbour backend used by SMOTE
+    nColumns : int or None
+        When given, only the first nColumns columns of X are used
+    seed : int or None
+        Seed of SMOTE
+    profilePath : string or None
+        When given, the fold runs under cProfile and its statistics are written
+        to this file, see instrument.profileFold
+
+    Returns
+    --------
+    (np.ndarray, np.ndarray)
+        The predicted probability of the positive class and the predicted class
+        for each hold-out instance
+    """
+    if profilePath is not None:
+        return instrument.profiled(profilePath, foldTask, X, y, clf, train, test, pctSMOTE, smoteAlgorithm,
+                                   nColumns, seed)
+    if nColumns is not None:
+        X = X[:, :nColumns]
+    with instrument.span('fold', train=len(train), test=len(test), features=X.shape[1]):
+        # The fitted classifier is discarded after predicting, so the training
+        # matrix can live in the reusable buffer of this process
+        X_train, y_train = trainingSet(X, y, train, pctSMOTE, smoteAlgorithm, seed, reuse=True)
+        return fitPredict(clf, X_train, y_train, X[test])
+
+
+def trainingSet(X, y, train, pctSMOTE=None, smoteAlgorithm='auto', seed=None, reuse=False):
+    """ Training instances and labels, optionally extended by SMOTE
+
+    The training matrix is copied out of X once, SMOTEd instances included.
+
+    Parameters
+    ----------
+    X : np.ndarray
+        The entire dataset
+    y : np.ndarray
+        The labels
+    train : np.ndarray
+        The array indexes of the training instances
+    pctSMOTE : int or None
+        When given, SMOTEd minority instances are appended to the training set
+    smoteAlgorithm : string
+        The nearest neighbour backend used by SMOTE
+    seed : int or None
+        Seed of SMOTE
+    reuse : bool
+        Build dense training matrices in a buffer reused from call to call, see
+        resampling.gather
+
+    Returns
+    --------
+    (np.ndarray, np.ndarray)
+        The training instances and their labels
+    """
+    train = np.asarray(train)
+    y_train = y[train]
+    smotted = None
+    if pctSMOTE is not None:
+        # SMOTE the minority class and append new instances to training set
+        minority = train[y_train == 1]
+        with instrument.span('smote', rows=len(minority), features=X.shape[1], pctSMOTE=pctSMOTE):
+            smotted = smote(X[minority], pctSMOTE, 5, algorithm=smoteAlgorithm, random_state=seed)
+        y_train = np.append(y_train, np.ones(len(smotted), dtype=y_train.dtype))
+    return resampling.gather(X, train, smotted, reuse), y_train
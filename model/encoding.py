@@ -0,0 +1,208 @@
+"""
+Categorical Feature Encoding
+"""
+
+#########################################################################################
+# One-hot encodes every categorical column of a pandas DataFrame in a single pass,      #
+# writing numeric columns and dummy variables straight into one preallocated dense      #
+# array or into a scipy sparse matrix, so that high-cardinality columns such as school  #
+# codes never have to materialize as dense DataFrame columns.                           #
+#########################################################################################
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+# Frames with at most this many numeric cells, e.g. single students scored on demand,
+# have their numeric columns read in one operation rather than one column at a time
+SMALL_FRAME = 2**16
+
+
+# Categorical columns of frames with at most this many rows are looked up value by value
+# rather than factorized first
+SMALL_COLUMN = 64
+
+
+def canonical(value):
+    """ Canonical string of a category value, so that a school code matches whether it
+    was read as 245, 245.0 or '245.0', e.g. by pd.read_csv or as a categorical by
+    ingest.readCohort. Numbers, and strings written the way a number prints, map to
+    their shortest numeric form, any other value to its string: '007' and '1e3' stay
+    distinct from 7 and 1000.
+    """
+    if isinstance(value, basestring):
+        try:
+            number = float(value)
+        except ValueError:
+            return unicode(value)
+        key = numberKey(number)
+        if key is None or value not in (key, unicode(repr(number))):
+            return unicode(value)
+        return key
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return unicode(value)
+    key = numberKey(number)
+    return unicode(value) if key is None else key
+
+
+def numberKey(number):
+    """ Shortest string of a finite float, without a trailing .0, None otherwise """
+    if number != number or number in (np.inf, -np.inf):
+        return None
+    if number.is_integer():
+        return u'%d' % number
+    return unicode(repr(number))
+
+
+class CategoricalEncoder:
+
+    def __init__(self, dtype=np.float64, sparse=False):
+        """ One-hot encoder for the categorical columns of a DataFrame.
+
+        The output layout matches what pd.get_dummies produced column by column:
+        numeric columns first, in their original order, followed by one dummy column
+        per category value of each categorical column, named <column>_<value>.
+
+        Parameters
+        ----------
+        dtype : np.dtype
+            The type of the encoded matrix, e.g. np.float32 to halve its size
+        sparse : bool
+            A flag to denote whether to return a scipy.sparse CSR matrix
+
+        """
+        self.dtype = dtype
+        self.sparse = sparse
+
+
+    def fit(self, dataSet, exclude=(), categorical=()):
+        """ Learn which columns are categorical and their vocabularies.
+
+        Parameters
+        ----------
+        dataSet : pd.DataFrame
+            The data to be encoded
+        exclude : list
+            Columns to leave out of the encoded matrix, e.g. the dependent variable
+        categorical : list
+            Columns to encode even though they are numeric, e.g. integer school codes
+
+        Returns
+        --------
+        CategoricalEncoder
+            The fitted encoder itself
+        """
+        self.numeric = []; self.categorical = []
+        for column, tp in zip(dataSet.columns, dataSet.dtypes):
+            if column in exclude:
+                continue
+            if tp == 'object' or str(tp) == 'category' or column in categorical:
+                self.categorical.append(column)
+            else:
+                self.numeric.append(column)
+
+        # Category values are sorted, as they would be by pd.get_dummies, and matched
+        # by their canonical form, the first of the values sharing one being kept
+        self.categories = {}; self.keys = {}
+        for column in self.categorical:
+            values = pd.Index(np.sort(pd.unique(dataSet[column].dropna().values).astype(object)))
+            keys = pd.Index([canonical(v) for v in values], dtype=object)
+            self.categories[column] = values[~keys.duplicated()]
+            self.keys[column] = self.positions(self.categories[column])
+
+        self.featureNames = list(self.numeric); self.featureSources = list(self.numeric)
+        for column in self.categorical:
+            self.featureNames.extend(u'%s_%s' % (column, value) for value in self.categories[column])
+            self.featureSources.extend([column] * len(self.categories[column]))
+        return self
+
+
+    def transform(self, dataSet, features=None):
+        """ Encode a DataFrame with the learned vocabularies.
+
+        Category values that were not seen by fit, as well as missing values, are
+        encoded as all-zero dummy rows.
+
+        Parameters
+        ----------
+        dataSet : pd.DataFrame
+            The data to be encoded, containing at least the columns seen by fit
+        features : np.ndarray or None
+            Sorted positions in featureNames of the only features to materialize,
+            e.g. those kept by feature selection. Columns that none of them depend
+            on are not read at all
+
+        Returns
+        --------
+        np.ndarray or scipy.sparse.csr_matrix
+            The encoded matrix, of shape [n_samples, len(featureNames)] or
+            [n_samples, len(features)]
+        """
+        n = len(dataSet)
+        nFeatures = len(self.featureNames)
+
+        # Output position of every encoded feature, -1 for those left out
+        if features is None:
+            position = np.arange(nFeatures)
+        else:
+            position = np.empty(nFeatures, dtype=np.intp)
+            position.fill(-1)
+            position[features] = np.arange(len(features))
+        nOutput = int((position >= 0).sum())
+        nNumeric = int((position[:len(self.numeric)] >= 0).sum())
+
+        # Copy numeric columns one at a time to avoid an intermediate float64 block
+        dense = np.empty((n, nNumeric if self.sparse else nOutput), dtype=self.dtype)
+        kept = [j for j in xrange(len(self.numeric)) if position[j] >= 0]
+        if n * len(kept) <= SMALL_FRAME:
+            columns = dataSet.columns.get_indexer([self.numeric[j] for j in kept])
+            if (columns < 0).any():
+                raise KeyError(self.numeric[kept[np.flatnonzero(columns < 0)[0]]])
+            dense[:, position[kept]] = dataSet.iloc[:, columns].values
+        else:
+            for j in kept:
+                dense[:, position[j]] = dataSet[self.numeric[j]].values
+
+        # Locate the dummy column hit by each row of every categorical column
+        rows = []; cols = []
+        offset = len(self.numeric)
+        for column in self.categorical:
+            width = len(self.categories[column])
+            if (position[offset:offset + width] >= 0).any():
+                codes = self.codes(column, dataSet[column].values)
+                hit = np.flatnonzero(codes >= 0)
+                target = position[offset + codes[hit]]
+                rows.append(hit[target >= 0])
+                cols.append(target[target >= 0])
+            offset += width
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.intp)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.intp)
+
+        if not self.sparse:
+            dense[:, nNumeric:] = 0
+            dense[rows, cols] = 1
+            return dense
+
+        dummies = sp.coo_matrix((np.ones(len(rows), dtype=self.dtype), (rows, cols - nNumeric)),
+                                shape=(n, nOutput - nNumeric))
+        return sp.hstack((sp.csr_matrix(dense), dummies), format='csr', dtype=self.dtype)
+
+
+    def codes(self, column, values):
+        """ Position in the vocabulary of column of every value, -1 for missing and unseen ones """
+        keys = self.keys[column]
+        if len(values) <= SMALL_COLUMN:
+            return np.array([-1 if pd.isnull(v) else keys.get(canonical(v), -1) for v in values], dtype=np.intp)
+        inverse, uniques = pd.factorize(values)
+        # Missing values, coded -1 by factorize, hit the trailing -1
+        found = np.array([keys.get(canonical(v), -1) for v in uniques] + [-1], dtype=np.intp)
+        return found[inverse]
+
+
+    @staticmethod
+    def positions(categories):
+        """ Position of every category of a vocabulary by canonical form """
+        return dict((canonical(value), i) for i, value in enumerate(categories))
@@ -0,0 +1,204 @@
+"""
+Preprocessing Cache
+"""
+
+#########################################################################################
+# Stores the outcome of classification.Model preprocessing (the processed dataset, the #
+# labels, the student ids and the fitted encoder, feature mask, scaler and PCA) on disk #
+# under a key derived from the content of the input DataFrame and the constructor       #
+# parameters. Arrays are written as .npy files that are memory-mapped when reloaded,    #
+# so a warm construction parses nothing and reads only what is later used. Entries are #
+# written atomically and the least recently used ones are evicted beyond a size bound. #
+#########################################################################################
+
+import cPickle
+import hashlib
+import os
+import shutil
+import time
+import zlib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+# Part of every key: bump when the layout of an entry or the preprocessing changes
+FORMAT_VERSION = 1
+
+# Default bound on the total size of a cache directory, in bytes
+MAX_BYTES = 8 * 2**30
+
+
+def _text(value):
+    """ Byte string of a value, UTF-8 encoded when it is unicode, e.g. u'caf\\xe9' """
+    return value.encode('utf-8') if isinstance(value, unicode) else str(value)
+
+
+def _checksum(a):
+    """ Checksum of the content of an array, fast enough for multi-GB frames """
+    a = np.asarray(a)
+    if a.dtype.hasobject:
+        data = '\0'.join(map(_text, a.ravel()))
+    else:
+        data = np.ascontiguousarray(a).view(np.uint8).data
+    return '%08x%08x' % (zlib.crc32(data) & 0xffffffff, zlib.adler32(data) & 0xffffffff)
+
+
+def frameHash(dataSet):
+    """ Content hash of a DataFrame: its index, column names, types and values.
+
+    Each column is checksummed with CRC-32 and Adler-32 at a few GB/s, and the
+    checksums are combined with SHA-1.
+
+    Returns
+    --------
+    string
+        A hexadecimal digest
+    """
+    digest = hashlib.sha1()
+    digest.update(str((dataSet.shape, [_text(c) for c in dataSet.columns], [str(t) for t in dataSet.dtypes])))
+    digest.update(_checksum(dataSet.index.values))
+    for column in dataSet.columns:
+        values = dataSet[column].values
+        if str(dataSet[column].dtype) == 'category':
+            digest.update(_checksum(values.codes) + _checksum(np.asarray(values.categories)))
+        else:
+            digest.update(_checksum(values))
+    return digest.hexdigest()
+
+
+def entryKey(frame, **params):
+    """ Key of a preprocessing run, from the frame hash and the constructor parameters """
+    return hashlib.sha1(str((FORMAT_VERSION, frame, sorted(params.items())))).hexdigest()
+
+
+def _indexValues(index):
+    """ The values of an index as an array that can be saved without pickling, or None """
+    values = index.values
+    if not values.dtype.hasobject:
+        return values
+    kind = pd.api.types.infer_dtype(values)
+    if kind == 'string':
+        return values.astype(str)
+    if kind == 'unicode':
+        return values.astype(unicode)
+    return None
+
+
+def _size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, files in os.walk(path) for name in files)
+
+
+def _entries(cacheDir):
+    """ Paths of the complete entries of a cache directory """
+    if not os.path.isdir(cacheDir):
+        return []
+    return [os.path.join(cacheDir, name) for name in os.listdir(cacheDir)
+            if name.startswith('prep-') and not name.endswith('.tmp')
+            and os.path.exists(os.path.join(cacheDir, name, 'state.pkl'))]
+
+
+def evict(cacheDir, maxBytes=MAX_BYTES, keep=None):
+    """ Remove the least recently used entries until the cache fits in maxBytes.
+
+    Parameters
+    ----------
+    cacheDir : string
+        The cache directory
+    maxBytes : int
+        The bound on the total size of the entries
+    keep : string or None
+        An entry that must not be removed, e.g. the one just written
+
+    """
+    entries = sorted((os.path.getmtime(path), path, _size(path)) for path in _entries(cacheDir))
+    total = sum(size for mtime, path, size in entries)
+    for mtime, path, size in entries:
+        if total <= maxBytes:
+            break
+        if path != keep:
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def save(cacheDir, key, arrays, state, maxBytes=MAX_BYTES):
+    """ Write an entry atomically, then evict old entries.
+
+    Parameters
+    ----------
+    cacheDir : string
+        The cache directory
+    key : string
+        The key of the entry, see entryKey
+    arrays : dict
+        Named np.ndarray, scipy.sparse matrices or pd.Index, reloaded memory-mapped.
+        Indexes of strings are stored as fixed width arrays
+    state : dict
+        Any other picklable objects, e.g. fitted preprocessing steps
+    maxBytes : int
+        The bound on the total size of the cache directory
+
+    """
+    path = os.path.join(cacheDir, 'prep-' + key)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    os.makedirs(tmp)
+    try:
+        layout = {}
+        for name, a in arrays.items():
+            if isinstance(a, pd.Index):
+                values = _indexValues(a)
+                if values is None:
+                    state = dict(state, **{name: a})
+                    continue
+                np.save(os.path.join(tmp, name + '.npy'), values)
+                layout[name] = ('index', a.name)
+            elif sp.issparse(a):
+                a = a.tocsr()
+                for part in ('data', 'indices', 'indptr'):
+                    np.save(os.path.join(tmp, name + '_' + part + '.npy'), getattr(a, part))
+                layout[name] = ('csr', a.shape)
+            else:
+                np.save(os.path.join(tmp, name + '.npy'), np.asarray(a))
+                layout[name] = ('dense', None)
+        with open(os.path.join(tmp, 'state.pkl'), 'wb') as f:
+            cPickle.dump((layout, state), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+    except OSError:
+        # Another process stored the same entry first
+        if not os.path.exists(os.path.join(path, 'state.pkl')):
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    evict(cacheDir, maxBytes, keep=path)
+
+
+def load(cacheDir, key):
+    """ Read an entry written by save, or None when there is none.
+
+    Returns
+    --------
+    (dict, dict) or None
+        The arrays, memory-mapped read-only, and the state
+    """
+    path = os.path.join(cacheDir, 'prep-' + key)
+    try:
+        with open(os.path.join(path, 'state.pkl'), 'rb') as f:
+            layout, state = cPickle.load(f)
+        arrays = {}
+        for name, (kind, extra) in layout.items():
+            if kind == 'dense':
+                arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+            elif kind == 'index':
+                values = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                arrays[name] = pd.Index(values.astype(object) if values.dtype.kind in 'SU' else np.asarray(values),
+                                        name=extra)
+            else:
+                parts = [np.load(os.path.join(path, name + '_' + part + '.npy'), mmap_mode='r')
+                         for part in ('data', 'indices', 'indptr')]
+                arrays[name] = sp.csr_matrix(tuple(parts), shape=extra, copy=False)
+    except (IOError, OSError, EOFError, ValueError):
+        return None
+    # Mark the entry as recently used
+    now = time.time()
+    os.utime(path, (now, now))
+    return arrays, state
@@ -0,0 +1,179 @@
+"""
+Cohort Ingestion and Out-of-core Scoring
+"""
+
+#########################################################################################
+# Reads student cohort CSVs with a declared column schema instead of pandas' default    #
+# type inference: the grade-by-grade feature families are stored as float32 and school  #
+# codes as categoricals. Files can be read in chunks, which allows a fitted             #
+# pipeline.RiskPipeline to score cohorts of any size in bounded memory, streaming the   #
+# risk scores to an output file as it goes.                                             #
+#########################################################################################
+
+import os
+import re
+import numpy as np
+import pandas as pd
+import instrument
+
+
+# Compact types for the column families of the student records, where N is the grade
+# block (1 for grade 6, 2 for grade 7 and so on)
+SCHEMA = [(r'^absrate\d+$', np.float32),
+          (r'^tardyr\d+$', np.float32),
+          (r'^nsusp\d+$', np.float32),
+          (r'^mobility\d+$', np.float32),
+          (r'^q[1-4]mpa\d+$', np.float32),
+          (r'^school\d+$', 'category')]
+
+
+def schema(columns, families=SCHEMA, overrides=None):
+    """ Column types for a cohort file.
+
+    Parameters
+    ----------
+    columns : list
+        The column names found in the file header
+    families : list
+        A list of (regular expression, type) pairs, the first match wins
+    overrides : dict or None
+        Explicit types for individual columns, taking precedence over families
+
+    Returns
+    --------
+    dict
+        The type of every column matched by families or overrides, to be passed as
+        the dtype argument of pd.read_csv. Other columns keep pandas' inference
+    """
+    patterns = [(re.compile(pattern), tp) for pattern, tp in families]
+    dtypes = {}
+    for column in columns:
+        for pattern, tp in patterns:
+            if pattern.match(column):
+                dtypes[column] = tp
+                break
+    if overrides:
+        dtypes.update(overrides)
+    return dtypes
+
+
+def readCohort(path, chunksize=None, families=SCHEMA, overrides=None, index_col=0, **kwargs):
+    """ Load a cohort CSV with compact column types.
+
+    Parameters
+    ----------
+    path : string
+        The CSV file, with student ids in its first column by default
+    chunksize : int or None
+        When given, the file is read lazily in chunks of this many students
+    families : list
+        A list of (regular expression, type) pairs, see schema
+    overrides : dict or None
+        Explicit types for individual columns
+    index_col : int or string
+        The column holding the student ids
+    kwargs : keyword arguments
+        Passed on to pd.read_csv
+
+    Returns
+    --------
+    pd.DataFrame or iterator of pd.DataFrame
+        The whole cohort, or an iterator over its chunks when chunksize is given
+    """
+    columns = pd.read_csv(path, nrows=0).columns
+    dtypes = schema(columns, families, overrides)
+    return pd.read_csv(path, index_col=index_col, dtype=dtypes, chunksize=chunksize, **kwargs)
+
+
+def scoreFile(path, pipeline, outPath, chunksize=100000, families=SCHEMA, overrides=None, ranking=None, **kwargs):
+    """ Score a cohort CSV chunk by chunk and stream the risk scores to a file.
+
+    Only one chunk of student records is held in memory at a time, so the size of
+    the cohort is only bounded by disk space.
+
+    Parameters
+    ----------
+    path : string
+        The cohort CSV to be scored
+    pipeline : pipeline.RiskPipeline
+        A fitted pipeline, see classification.Model.fitPipeline
+    outPath : string
+        The CSV file the student ids and risk scores are written to
+    chunksize : int
+        The number of students read and scored at once
+    families : list
+        A list of (regular expression, type) pairs, see schema
+    overrides : dict or None
+        Explicit types for individual columns
+    ranking : ranking.TopK or None
+        When given, every scored chunk is also fed to this accumulator, so that the
+        highest risk students overall or per group are known at the end of the run
+    kwargs : keyword arguments
+        Passed on to pd.read_csv
+
+    Returns
+    --------
+    int
+        The number of students scored
+    """
+    if 'usecols' not in kwargs:
+        # Only read the columns the pipeline needs, plus the student ids
+        header = pd.read_csv(path, nrows=0).columns
+        needed = set(pipeline.columns) | set(ranking.groupBy if ranking is not None else [])
+        kwargs['usecols'] = [c for i, c in enumerate(header) if i == 0 or c in needed]
+
+    tmp = outPath + '.tmp'
+    scored = 0
+    with open(tmp, 'w') as out:
+        for i, chunk in enumerate(readCohort(path, chunksize, families, overrides, **kwargs)):
+            with instrument.span('scoreChunk', model=pipeline.model, rows=len(chunk), columns=chunk.shape[1]):
+                risk = pipeline.predictRisk(chunk)
+            risk.to_csv(out, header=(i == 0), index_label=chunk.index.name or 'id', float_format='%.6f')
+            if ranking is not None:
+                ranking.update(chunk.index, risk.values, chunk[ranking.groupBy] if ranking.groupBy else None)
+            scored += len(risk)
+    os.rename(tmp, outPath)
+    return scored
+
+
+def checkScores(path, pipeline, scoresPath, chunksize=100000, tolerance=1e-5):
+    """ Largest difference between a scores file written by scoreFile and the risk the
+    pipeline gives the same students read with pandas' default type inference, as the
+    training data usually is. Both should agree up to the 6 decimals written.
+
+    Parameters
+    ----------
+    path : string
+        The cohort CSV that was scored
+    pipeline : pipeline.RiskPipeline
+        The pipeline it was scored with
+    scoresPath : string
+        The scores file written by scoreFile
+    chunksize : int
+        The number of students compared at once
+    tolerance : float
+        The largest difference accepted
+
+    Returns
+    --------
+    float
+        The largest absolute difference between the two risk scores of a student
+
+    Raises
+    --------
+    ValueError
+        When the students differ or a difference exceeds tolerance
+    """
+    largest = 0.
+    cohort = pd.read_csv(path, index_col=0, chunksize=chunksize)
+    scores = pd.read_csv(scoresPath, index_col=0, chunksize=chunksize)
+    for chunk, written in zip(cohort, scores):
+        if not chunk.index.astype(str).equals(written.index.astype(str)):
+            raise ValueError('%s and %s do not hold the same students' % (path, scoresPath))
+        expected = pipeline.predictRisk(chunk).values
+        largest = max(largest, float(np.abs(written.iloc[:, 0].values - expected).max()))
+    if next(cohort, None) is not None or next(scores, None) is not None:
+        raise ValueError('%s and %s do not hold the same students' % (path, scoresPath))
+    if largest > tolerance:
+        raise ValueError('Scores of %s differ from RiskPipeline.predictRisk by up to %g' % (scoresPath, largest))
+    return largest
@@ -0,0 +1,198 @@
+"""
+Pipeline Instrumentation
+"""
+
+#########################################################################################
+# Timed spans around every stage of the pipeline (encoding, feature selection, scaling, #
+# PCA, resampling, and the fit and predict of every fold), carrying row and feature     #
+# counts plus the resident and peak memory of the process. Spans are sent to pluggable #
+# sinks: an in-memory list, a JSON lines file or the logging module. Spans emitted in   #
+# worker processes are collected there and re-emitted by the parent process. Without   #
+# any sink, spans cost next to nothing. A single fold can also be run under cProfile.   #
+#########################################################################################
+
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import resource
+import time
+import numpy as np
+
+
+# Sinks receiving every finished span, and the names of the spans currently open
+_sinks = []
+_stack = []
+
+# Fold to be profiled, see profileFold
+_profile = None
+
+
+class MemorySink:
+
+    def __init__(self):
+        """ Keeps every span record in a list """
+        self.records = []
+
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+    def table(self):
+        """ The records as a pd.DataFrame, one row per span """
+        import pandas as pd
+        return pd.DataFrame(self.records)
+
+
+class JsonLinesSink:
+
+    def __init__(self, path):
+        """ Appends every span record to a JSON lines file at path """
+        self.path = path
+
+
+    def emit(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True, default=_jsonValue) + '\n')
+
+
+class LoggingSink:
+
+    def __init__(self, logger=None, level=logging.INFO):
+        """ Logs one line per span, to the 'instrument' logger by default """
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+
+    def emit(self, record):
+        fields = ' '.join('%s=%s' % (k, record[k]) for k in sorted(record)
+                          if k not in ('name', 'seconds', 'start', 'parent') and record[k] is not None)
+        self.logger.log(self.level, '%s took %.3fs %s', record['name'], record['seconds'], fields)
+
+
+def _jsonValue(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def addSink(sink):
+    """ Send spans to sink, any object with an emit(record) method """
+    _sinks.append(sink)
+    return sink
+
+
+def removeSink(sink):
+    _sinks.remove(sink)
+
+
+def active():
+    """ Whether spans are being recorded """
+    return bool(_sinks)
+
+
+def emit(record):
+    for sink in _sinks:
+        sink.emit(record)
+
+
+def _status(field):
+    """ A memory figure of /proc/self/status in MB, or None """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024.
+    except IOError:
+        pass
+    return None
+
+
+def memory():
+    """ Current (rssMB) and peak (peakMB) resident memory of the process in MB """
+    peak = _status('VmHWM')
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    return {'rssMB': _status('VmRSS'), 'peakMB': peak}
+
+
+@contextlib.contextmanager
+def span(name, **fields):
+    """ Time a block of code and emit it as a span.
+
+    The yielded dict holds the fields of the span, e.g. rows and features, and can be
+    completed inside the block. The emitted record adds name, parent (the enclosing
+    span), start, seconds, pid, rssMB and peakMB.
+    """
+    if not _sinks:
+        yield fields
+        return
+    parent = _stack[-1] if _stack else None
+    _stack.append(name)
+    start = time.time()
+    try:
+        yield fields
+    finally:
+        _stack.pop()
+        record = dict(fields, name=name, parent=parent, start=start, seconds=time.time() - start, pid=os.getpid())
+        record.update(memory())
+        emit(record)
+
+
+@contextlib.contextmanager
+def capture():
+    """ Collect the spans of a block in a list instead of sending them to the sinks """
+    global _sinks
+    saved = _sinks
+    sink = MemorySink()
+    _sinks = [sink]
+    try:
+        yield sink.records
+    finally:
+        _sinks = saved
+
+
+def profileFold(path, model=None, fold=0, variant='base'):
+    """ Run one cross validation fold under cProfile.
+
+    Parameters
+    ----------
+    path : string
+        The file the profile statistics are written to, readable with pstats. It may
+        contain {model}, {fold} and {variant} placeholders
+    model : string or None
+        The 2-3 letter code of the model to profile, every model by default
+    fold : int
+        The fold to profile
+    variant : string
+        'base' or 'smote'
+
+    """
+    global _profile
+    _profile = (path, model, fold, variant)
+
+
+def stopProfiling():
+    global _profile
+    _profile = None
+
+
+def profilePath(model, fold, variant):
+    """ The profile file of a fold, or None when the fold is not to be profiled """
+    if _profile is None:
+        return None
+    path, target, targetFold, targetVariant = _profile
+    if target in (None, model) and fold == targetFold and variant == targetVariant:
+        return path.format(model=model, fold=fold, variant=variant)
+    return None
+
+
+def profiled(path, function, *args, **kwargs):
+    """ Call function under cProfile and write the statistics to path """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
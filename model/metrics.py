@@ -0,0 +1,256 @@
+"""
+Ranking Metrics and Bootstrap Confidence Intervals
+"""
+
+#########################################################################################
+# Evaluates out-of-fold risk scores from a single descending sort: the ROC and          #
+# precision-recall curves, precision and recall at any number of top-k cutoffs and the  #
+# confusion matrix at any threshold are all read off cumulative counts over the sorted  #
+# scores. Bootstrap confidence intervals reuse the same sort, drawing every resample as #
+# a vector of multiplicities so that thousands of resamples are evaluated as a few      #
+# batched array operations.                                                             #
+#########################################################################################
+
+import numpy as np
+import pandas as pd
+import ranking
+
+
+class Curve:
+
+    def __init__(self, y, scores, order=None):
+        """ Cumulative true and false positive counts over the descending scores.
+
+        Parameters
+        ----------
+        y : np.ndarray
+            The binary labels, 1 for the positive (at-risk) class
+        scores : np.ndarray
+            The risk scores
+        order : np.ndarray or None
+            The positions of scores in descending order, when already known
+
+        """
+        y = np.asarray(y)
+        scores = np.asarray(scores, dtype=float)
+        if order is None:
+            order = np.argsort(-scores, kind='mergesort')
+        self.order = order
+        self.scores = scores[order]
+        self.hits = (y[order] == 1)
+        self.tp = np.cumsum(self.hits)
+        self.nPos = int(self.tp[-1]) if len(self.tp) else 0
+        self.nNeg = len(self.tp) - self.nPos
+
+        # Last position of every run of tied scores, the only points a threshold can split
+        self.cuts = np.r_[np.flatnonzero(np.diff(self.scores)), len(self.scores) - 1]
+        self.thresholds = self.scores[self.cuts]
+        self.tps = self.tp[self.cuts]
+        self.fps = self.cuts + 1 - self.tps
+
+
+    def split(self, groups):
+        """ One curve per group, e.g. per fold, without sorting again.
+
+        Parameters
+        ----------
+        groups : np.ndarray
+            The integer group of each score, e.g. predictions.FoldPredictions.folds
+
+        Returns
+        --------
+        list
+            A Curve per group, from group 0 to the largest group
+        """
+        sortedGroups = np.asarray(groups)[self.order]
+        y = self.hits.astype(int)
+        curves = []
+        for g in xrange(sortedGroups.max() + 1):
+            members = np.flatnonzero(sortedGroups == g)
+            curves.append(Curve(y[members], self.scores[members], np.arange(len(members))))
+        return curves
+
+
+    def roc(self):
+        """ False positive rates, true positive rates and thresholds, as sklearn's roc_curve """
+        fps, tps, thresholds = self.fps, self.tps, self.thresholds
+        if fps[0] != 0:
+            # Start the curve at the origin
+            fps, tps, thresholds = np.r_[0, fps], np.r_[0, tps], np.r_[thresholds[0] + 1, thresholds]
+        return fps / float(max(self.nNeg, 1)), tps / float(max(self.nPos, 1)), thresholds
+
+
+    def auc(self):
+        """ Area under the ROC curve """
+        fpr, tpr, thresholds = self.roc()
+        return np.trapz(tpr, fpr)
+
+
+    def pr(self):
+        """ Precision, recall and thresholds, as sklearn's precision_recall_curve """
+        last = np.searchsorted(self.tps, self.tps[-1])
+        stop = slice(last, None, -1)
+        precision = self.tps / (self.tps + self.fps).astype(float)
+        recall = self.tps / float(max(self.nPos, 1))
+        return np.r_[precision[stop], 1], np.r_[recall[stop], 0], self.thresholds[stop]
+
+
+    def atK(self, ks):
+        """ Precision and recall among the k highest scores, for a grid of k.
+
+        Parameters
+        ----------
+        ks : array-like
+            Numbers of students, or fractions of all students when below 1
+
+        Returns
+        --------
+        pd.DataFrame
+            Columns k, precision and recall, one row per value of ks
+        """
+        ks = np.asarray(ks, dtype=float)
+        k = np.where(ks < 1, ks * len(self.tp), ks).astype(np.intp)
+        k = np.clip(k, 1, len(self.tp))
+        found = self.tp[k - 1]
+        return pd.DataFrame({'k': k, 'precision': found / k.astype(float),
+                             'recall': found / float(max(self.nPos, 1))},
+                            index=pd.Index(ks, name='top'), columns=['k', 'precision', 'recall'])
+
+
+    def confusion(self, threshold=.5):
+        """ Confusion matrix when students scoring at least threshold are flagged.
+
+        Returns
+        --------
+        np.ndarray
+            [[true negatives, false positives], [false negatives, true positives]]
+        """
+        flagged = np.searchsorted(-self.scores, -threshold, side='right')
+        tp = self.tp[flagged - 1] if flagged else 0
+        fp = flagged - tp
+        return np.array([[self.nNeg - fp, fp], [self.nPos - tp, tp]])
+
+
+def precisionAtK(y, scores, topK):
+    """ Fraction of positives among the topK fraction of students at highest risk, the
+    single highest when topK * len(y) is below one """
+    r = ranking.topCount(topK, len(y))
+    return np.sum(y[ranking.topK(scores, r)]) / float(r)
+
+
+def confusion(y, pred):
+    """ Confusion matrix of binary labels and predictions in a single pass """
+    counts = np.bincount(2 * np.asarray(y, dtype=np.intp) + np.asarray(pred, dtype=np.intp), minlength=4)
+    return counts.reshape(2, 2)
+
+
+def report(cm, targetNames):
+    """ Precision, recall, F1 and support per class from a confusion matrix.
+
+    The layout follows sklearn's classification_report.
+
+    Parameters
+    ----------
+    cm : np.ndarray
+        A 2x2 confusion matrix, see confusion
+    targetNames : list
+        The names of the negative and the positive class
+
+    Returns
+    --------
+    string
+        The formatted report
+    """
+    cm = cm.astype(float)
+    support = cm.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.nan_to_num(np.diag(cm) / cm.sum(axis=0))
+        recall = np.nan_to_num(np.diag(cm) / support)
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+    width = max(len(name) for name in list(targetNames) + ['avg / total'])
+    lines = [' ' * width + '  %9s %9s %9s %9s\n' % ('precision', 'recall', 'f1-score', 'support')]
+    for i, name in enumerate(targetNames):
+        lines.append('%*s  %9.2f %9.2f %9.2f %9d' % (width, name, precision[i], recall[i], f1[i], support[i]))
+    weights = support / support.sum()
+    lines.append('\n%*s  %9.2f %9.2f %9.2f %9d' % (width, 'avg / total', weights.dot(precision),
+                                                   weights.dot(recall), weights.dot(f1), support.sum()))
+    return '\n'.join(lines) + '\n'
+
+
+def resampleCounts(n, size, random_state):
+    """ Multiplicity of every student in size bootstrap resamples of n students """
+    draws = random_state.randint(0, n, size=(size, n))
+    draws += (np.arange(size) * n)[:, np.newaxis]
+    return np.bincount(draws.ravel(), minlength=size * n).reshape(size, n)
+
+
+def bootstrap(y, scores, topK=.1, nBoot=2000, alpha=.05, seed=None, blockSize=None, curve=None):
+    """ Bootstrap confidence intervals for precision at top K and AUC.
+
+    Every resample is represented by the multiplicity of each student, so the
+    students never have to be sorted again: precision at top K is read off the
+    weighted cumulative counts along the original descending order, and AUC is
+    computed from weighted class counts within each run of tied scores. Resamples
+    are evaluated in blocks of rows of one array.
+
+    Parameters
+    ----------
+    y : np.ndarray
+        The binary labels
+    scores : np.ndarray
+        The risk scores
+    topK : float
+        The fraction of students at highest risk the precision is computed on
+    nBoot : int
+        The number of bootstrap resamples
+    alpha : float
+        1 - the confidence level of the percentile intervals
+    seed : int or None
+        Seed for the resampling
+    blockSize : int or None
+        The number of resamples evaluated at once; by default enough to fill
+        about 4M array cells
+    curve : Curve or None
+        A Curve of the same labels and scores, when already computed
+
+    Returns
+    --------
+    pd.DataFrame
+        Columns estimate, lower and upper for rows 'precision' and 'auc'
+    """
+    if curve is None:
+        curve = Curve(y, scores)
+    n = len(curve.scores)
+    r = ranking.topCount(topK, n)
+    if blockSize is None:
+        blockSize = max(1, 2**22 // max(n, 1))
+    starts = np.r_[0, curve.cuts[:-1] + 1]
+    hits = curve.hits.astype(float)
+    rs = np.random.RandomState(seed)
+
+    precision = np.empty(nBoot); area = np.empty(nBoot)
+    for begin in xrange(0, nBoot, blockSize):
+        w = resampleCounts(n, min(blockSize, nBoot - begin), rs).astype(float)
+        block = slice(begin, begin + len(w))
+
+        # Precision at top K: students are taken in score order until r are drawn,
+        # the last one only for the copies that still fit
+        drawn = np.cumsum(w, axis=1)
+        found = np.cumsum(w * hits, axis=1)
+        last = np.argmax(drawn >= r, axis=1)
+        rows = np.arange(len(w))
+        precision[block] = (found[rows, last] - hits[last] * (drawn[rows, last] - r)) / float(r)
+        del drawn, found
+
+        # AUC from the weighted positives and negatives of every run of tied scores
+        pos = np.add.reduceat(w * hits, starts, axis=1)
+        neg = np.add.reduceat(w, starts, axis=1) - pos
+        below = neg.sum(axis=1)[:, np.newaxis] - np.cumsum(neg, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            area[block] = (pos * (below + .5 * neg)).sum(axis=1) / (pos.sum(axis=1) * neg.sum(axis=1))
+
+    estimate = [curve.tp[r - 1] / float(r), curve.auc()]
+    q = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+    bounds = [np.percentile(precision, q), np.percentile(area[np.isfinite(area)], q)]
+    return pd.DataFrame({'estimate': estimate, 'lower': [b[0] for b in bounds], 'upper': [b[1] for b in bounds]},
+                        index=['precision', 'auc'], columns=['estimate', 'lower', 'upper'])
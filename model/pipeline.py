@@ -0,0 +1,137 @@
+"""
+Fitted Risk Scoring Pipeline
+"""
+
+#########################################################################################
+# Bundles every fitted step needed to turn raw student records into risk scores: the    #
+# categorical encoder, the feature selection mask, the scaler, the optional PCA and the #
+# trained classifier. A pipeline is created by classification.Model.fitPipeline, can    #
+# be saved to a single artifact file and scores new cohorts of any size, one DataFrame  #
+# or CSV chunk at a time, without importing the training code.                          #
+#########################################################################################
+
+import cPickle
+import os
+import numpy as np
+import pandas as pd
+
+
+class RiskPipeline:
+
+    def __init__(self, model, encoder, featureMask, scaler, pca, clf, denseInput=False):
+        """ Fitted preprocessing steps and classifier.
+
+        Parameters
+        ----------
+        model : string
+            The 2-3 letter code of the classifier
+        encoder : encoding.CategoricalEncoder
+            The fitted categorical encoder
+        featureMask : np.ndarray or None
+            Boolean mask of the encoded features kept by feature selection
+        scaler : sklearn.preprocessing.StandardScaler
+            The fitted scaler
+        pca : sklearn PCA or TruncatedSVD or None
+            The fitted decomposition, if any
+        clf : sklearn estimator
+            The classifier, trained on the whole processed dataset
+        denseInput : bool
+            A flag to denote that the classifier cannot take sparse matrices
+
+        """
+        self.model = model
+        self.encoder = encoder
+        self.featureMask = featureMask
+        self.scaler = scaler
+        self.pca = pca
+        self.clf = clf
+        self.denseInput = denseInput
+        self.features = None if featureMask is None else np.flatnonzero(featureMask)
+
+
+    @property
+    def columns(self):
+        """ The raw columns a cohort must provide to be scored """
+        sources = self.encoder.featureSources
+        if self.features is not None:
+            sources = [sources[i] for i in self.features]
+        return sorted(set(sources), key=sources.index)
+
+
+    def transform(self, dataSet):
+        """ Apply the fitted preprocessing steps to new student records.
+
+        Parameters
+        ----------
+        dataSet : pd.DataFrame
+            Student records with at least the columns listed in columns
+
+        Returns
+        --------
+        np.ndarray or scipy.sparse.csr_matrix
+            The processed records, ready for the classifier
+        """
+        X = self.encoder.transform(dataSet, self.features)
+        X = self.scaler.transform(X, copy=False)
+        if self.pca is not None:
+            X = self.pca.transform(X)
+        return X
+
+
+    def predictRisk(self, dataSet):
+        """ Probability of not graduating on time for each student.
+
+        Parameters
+        ----------
+        dataSet : pd.DataFrame
+            Student records indexed by student id
+
+        Returns
+        --------
+        pd.Series
+            The risk scores, between 0 and 1, indexed like dataSet
+        """
+        X = self.transform(dataSet)
+        if self.denseInput and hasattr(X, 'toarray'):
+            X = X.toarray()
+        return pd.Series(self.clf.predict_proba(X)[:, 1], index=dataSet.index, name='risk')
+
+
+    def partialFit(self, dataSet, labels):
+        """ Update the classifier online with newly labeled student records.
+
+        Only classifiers with a partial_fit method (e.g. the 'SGD' model) can be
+        updated this way; the preprocessing steps stay as fitted.
+
+        Parameters
+        ----------
+        dataSet : pd.DataFrame
+            Student records with at least the columns listed in columns
+        labels : array-like
+            Their binary labels, 1 for students who did not graduate on time
+
+        """
+        if not hasattr(self.clf, 'partial_fit'):
+            raise ValueError('The %s model cannot be updated online, train an SGD pipeline instead' % self.model)
+        X = self.transform(dataSet)
+        if self.denseInput and hasattr(X, 'toarray'):
+            X = X.toarray()
+        self.clf.partial_fit(X, np.asarray(labels), classes=np.array([0, 1]))
+
+
+    def save(self, path):
+        """ Write the pipeline to a single artifact file at path """
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            cPickle.dump(self, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+
+
+    @classmethod
+    def load(cls, path):
+        """ Read a pipeline written by save """
+        with open(path, 'rb') as f:
+            risk_pipeline = cPickle.load(f)
+        if not isinstance(risk_pipeline, cls):
+            raise ValueError(path + ' does not hold a RiskPipeline')
+        return risk_pipeline
@@ -0,0 +1,162 @@
+"""
+Out-of-fold Prediction Store
+"""
+
+#########################################################################################
+# Holds the out-of-fold probabilities, predictions and fold assignments produced by a   #
+# K-fold cross validation run of one model, so that every output format offered by      #
+# classification.Model.runClassification can be rendered without refitting anything.   #
+#########################################################################################
+
+import hashlib
+import os
+import numpy as np
+import scipy.sparse as sp
+
+
+def fingerprint(*arrays):
+    """ Content hash of a set of arrays.
+
+    Parameters
+    ----------
+    arrays : np.ndarray or scipy.sparse matrix
+        The arrays to be hashed, e.g. a processed dataset and its labels
+
+    Returns
+    -------
+    string
+        A hexadecimal SHA-1 digest that changes whenever shape, type or content change
+    """
+    digest = hashlib.sha1()
+    for a in arrays:
+        if sp.issparse(a):
+            a = a.tocsr()
+            digest.update(str(('csr', a.shape)))
+            digest.update(fingerprint(a.data, a.indices, a.indptr))
+            continue
+        a = np.ascontiguousarray(a)
+        digest.update(str((a.shape, a.dtype.str)))
+        if a.dtype.hasobject:
+            digest.update('\0'.join(map(str, a.ravel())))
+        else:
+            digest.update(a.view(np.uint8).data)
+    return digest.hexdigest()
+
+
+def predictionKey(model, clf, datasetHash, **plan):
+    """ Key identifying a cross validation run.
+
+    Parameters
+    ----------
+    model : string
+        The 2-3 letter code of the classifier
+    clf : sklearn estimator
+        The classifier itself; its parameters become part of the key
+    datasetHash : string
+        The fingerprint of the processed dataset and labels
+    plan : keyword arguments
+        Everything else that determines the result (number of folds, seed,
+        subsampling and SMOTE settings)
+
+    Returns
+    -------
+    string
+        A hexadecimal SHA-1 digest
+    """
+    params = sorted((k, repr(v)) for k, v in clf.get_params().items())
+    return hashlib.sha1(repr((model, params, datasetHash, sorted(plan.items())))).hexdigest()
+
+
+class FoldPredictions:
+
+    def __init__(self, key, nSamples, variants=('base',)):
+        """ Preallocated out-of-fold results of one model.
+
+        Every student appears in exactly one hold-out fold, so all results are stored
+        by row position in the processed dataset rather than concatenated per fold.
+
+        Parameters
+        ----------
+        key : string
+            The key returned by predictionKey for this run
+        nSamples : int
+            The number of students in the dataset
+        variants : tuple
+            The training set variants being evaluated, e.g. ('base', 'smote')
+
+        """
+        self.key = key
+        self.variants = tuple(variants)
+        self.folds = np.empty(nSamples, dtype=np.int16)
+        self.folds.fill(-1)
+        self.prob = dict((v, np.zeros(nSamples)) for v in self.variants)
+        self.pred = dict((v, np.zeros(nSamples, dtype=np.int8)) for v in self.variants)
+        self.seconds = dict((v, np.zeros(0)) for v in self.variants)
+
+
+    @property
+    def nFolds(self):
+        return int(self.folds.max()) + 1
+
+
+    def record(self, variant, fold, test, prob, pred, seconds=np.nan):
+        """ Store the results of a single hold-out fold.
+
+        Parameters
+        ----------
+        variant : string
+            The training set variant these results belong to
+        fold : int
+            The fold number
+        test : np.ndarray
+            The row positions of the hold-out students
+        prob : np.ndarray
+            The predicted probability of not graduating for each hold-out student
+        pred : np.ndarray
+            The predicted class of each hold-out student
+        seconds : float
+            The wall-clock time it took to train and evaluate the fold
+
+        """
+        self.folds[test] = fold
+        self.prob[variant][test] = prob
+        self.pred[variant][test] = pred
+        if fold >= len(self.seconds[variant]):
+            padding = np.empty(fold + 1 - len(self.seconds[variant]))
+            padding.fill(np.nan)
+            self.seconds[variant] = np.append(self.seconds[variant], padding)
+        self.seconds[variant][fold] = seconds
+
+
+    def complete(self):
+        """ Whether every student received an out-of-fold prediction """
+        return bool((self.folds >= 0).all())
+
+
+    def save(self, path):
+        """ Write the results to a .npz file at path """
+        arrays = {'key': np.array(self.key), 'variants': np.array(self.variants), 'folds': self.folds}
+        for v in self.variants:
+            arrays['prob_' + v] = self.prob[v]
+            arrays['pred_' + v] = self.pred[v]
+            arrays['seconds_' + v] = self.seconds[v]
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.rename(tmp, path)
+
+
+    @classmethod
+    def load(cls, path):
+        """ Read results previously written with save """
+        data = np.load(path)
+        store = cls(str(data['key']), len(data['folds']), [str(v) for v in data['variants']])
+        store.folds[:] = data['folds']
+        for v in store.variants:
+            store.prob[v][:] = data['prob_' + v]
+            store.pred[v][:] = data['pred_' + v]
+            if 'seconds_' + v in data.files:
+                store.seconds[v] = data['seconds_' + v]
+        return store
@@ -0,0 +1,262 @@
+"""
+Top-K Risk Ranking
+"""
+
+#########################################################################################
+# Selects the students at highest risk, either overall or within groups such as schools #
+# or grades, using partial selection (np.argpartition) instead of sorting every score.  #
+# Partial rankings computed on folds or on chunks of a cohort can be merged, keeping    #
+# only the current top candidates of each group in memory.                              #
+#########################################################################################
+
+import numpy as np
+import pandas as pd
+
+
+def topK(scores, k):
+    """ Positions of the k highest scores, highest first.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        The risk scores
+    k : int
+        The number of positions to return
+
+    Returns
+    --------
+    np.ndarray
+        The positions of the k highest scores, sorted by decreasing score
+    """
+    scores = np.asarray(scores)
+    k = min(int(k), len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='mergesort')]
+
+
+def topCount(fraction, n):
+    """ Number of students in the top fraction of n students, at least one.
+
+    Parameters
+    ----------
+    fraction : float
+        The fraction of students to keep
+    n : int or np.ndarray
+        The number of students, or of students in every group
+
+    Returns
+    --------
+    int or np.ndarray
+        The number to keep, or that of every group, 0 only for empty groups
+    """
+    counts = np.asarray(n)
+    if counts.ndim == 0:
+        if counts < 1:
+            raise ValueError('No students to rank')
+        return max(1, int(fraction * counts))
+    return np.where(counts > 0, np.maximum(1, (fraction * counts).astype(np.intp)), 0)
+
+
+def groupCodes(groups, n):
+    """ Integer group codes for one or several grouping keys.
+
+    Parameters
+    ----------
+    groups : array-like, pd.Series, pd.DataFrame or None
+        The group of each student; a DataFrame groups by the combination of its columns
+    n : int
+        The number of students
+
+    Returns
+    --------
+    (np.ndarray, pd.DataFrame)
+        The code of each student and a table with the key values of every code.
+        Missing key values form a group of their own
+    """
+    if groups is None:
+        return np.zeros(n, dtype=np.intp), pd.DataFrame(index=range(1))
+    if not isinstance(groups, pd.DataFrame):
+        name = getattr(groups, 'name', None) or 'group'
+        groups = pd.DataFrame({name: np.asarray(groups)})
+
+    codes = []; uniques = []
+    for column in groups.columns:
+        c, u = pd.factorize(np.asarray(groups[column]), sort=True)
+        if (c < 0).any():
+            c = np.where(c < 0, len(u), c)
+            u = np.append(np.asarray(u, dtype=object), np.nan)
+        codes.append(c); uniques.append(np.asarray(u))
+
+    if len(codes) == 1:
+        combined = codes[0]; parts = (np.arange(len(uniques[0])),)
+    else:
+        # Combine the per-key codes and renumber the combinations that occur
+        shape = tuple(max(len(u), 1) for u in uniques)
+        combined, keys = pd.factorize(np.ravel_multi_index(codes, shape), sort=True)
+        parts = np.unravel_index(keys, shape)
+    labels = pd.DataFrame(dict((column, uniques[j][parts[j]]) for j, column in enumerate(groups.columns)),
+                          columns=list(groups.columns))
+    return combined, labels
+
+
+def selectTop(scores, codes, nGroups, limit):
+    """ Positions of the highest scores within each group, in no particular order.
+
+    Groups with no more students than their limit are kept whole; larger groups are
+    reduced with np.argpartition, so no group is ever fully sorted.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        The risk scores
+    codes : np.ndarray
+        The group code of each score, between 0 and nGroups - 1
+    nGroups : int
+        The number of groups
+    limit : int or np.ndarray
+        The number of students to keep in every group, or in each group
+
+    Returns
+    --------
+    np.ndarray
+        The selected positions
+    """
+    counts = np.bincount(codes, minlength=nGroups)
+    limit = np.minimum(np.broadcast_to(np.asarray(limit, dtype=np.intp), (nGroups,)), counts)
+    over = counts > limit
+    selected = [np.flatnonzero(~over[codes])]
+
+    members = np.flatnonzero(over[codes])
+    if len(members):
+        members = members[np.argsort(codes[members])]
+        start = 0
+        for g in np.flatnonzero(over):
+            block = members[start:start + counts[g]]
+            start += counts[g]
+            if limit[g] > 0:
+                selected.append(block[np.argpartition(-scores[block], limit[g] - 1)[:limit[g]]])
+    return np.concatenate(selected)
+
+
+def orderTop(scores, codes, selected):
+    """ Order selected positions by group and decreasing score, with their ranks.
+
+    Returns
+    --------
+    (np.ndarray, np.ndarray)
+        The ordered positions and the rank of each of them within its group, from 1
+    """
+    order = selected[np.lexsort((-scores[selected], codes[selected]))]
+    sortedCodes = codes[order]
+    ranks = np.arange(len(order)) - np.searchsorted(sortedCodes, sortedCodes, side='left') + 1
+    return order, ranks
+
+
+def rank(students, scores, n=None, fraction=None, groups=None):
+    """ Ranked table of the students at highest risk.
+
+    Parameters
+    ----------
+    students : array-like
+        The student ids
+    scores : np.ndarray
+        The risk scores
+    n : int or None
+        The number of students to keep in each group (or overall without groups)
+    fraction : float or None
+        The fraction of each group to keep, at least one student, used when n is
+        not given
+    groups : array-like, pd.Series, pd.DataFrame or None
+        The group of each student, e.g. df['school7'] aligned with students
+
+    Returns
+    --------
+    pd.DataFrame
+        Columns student, score and rank, plus one column per grouping key, ordered by
+        group and rank
+    """
+    scores = np.asarray(scores, dtype=float)
+    codes, labels = groupCodes(groups, len(scores))
+    if n is None:
+        counts = np.bincount(codes, minlength=len(labels))
+        n = topCount(fraction, counts)
+    order, ranks = orderTop(scores, codes, selectTop(scores, codes, len(labels), n))
+    table = pd.DataFrame({'student': np.asarray(students)[order], 'score': scores[order], 'rank': ranks},
+                         columns=['student', 'score', 'rank'])
+    for column in labels.columns:
+        table[column] = labels[column].values[codes[order]]
+    return table
+
+
+def writeTable(table, path):
+    """ Write a ranked table as Parquet when path ends in .parquet, as CSV otherwise """
+    if path.endswith('.parquet'):
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+
+
+class TopK:
+
+    def __init__(self, n, groupBy=None):
+        """ Streaming top-n selection, overall or per group.
+
+        Scores are fed in pieces (folds, cohort chunks) with update, or whole
+        accumulators are combined with merge. After each step only the current n best
+        candidates of every group are kept.
+
+        Parameters
+        ----------
+        n : int
+            The number of students to keep in each group
+        groupBy : list or None
+            The names of the grouping keys, e.g. ['school7']. When scoring files with
+            ingest.scoreFile, these columns are read from every chunk
+
+        """
+        self.n = n
+        self.groupBy = list(groupBy) if groupBy else []
+        self.students = np.zeros(0, dtype=object)
+        self.scores = np.zeros(0)
+        self.groups = pd.DataFrame(columns=self.groupBy)
+
+
+    def update(self, students, scores, groups=None):
+        """ Add scored students and drop those that fell out of the top n.
+
+        Parameters
+        ----------
+        students : array-like
+            The student ids
+        scores : np.ndarray
+            Their risk scores
+        groups : pd.DataFrame, pd.Series, array-like or None
+            The value of every grouping key for each student
+
+        """
+        if self.groupBy:
+            if not isinstance(groups, pd.DataFrame):
+                groups = pd.DataFrame({self.groupBy[0]: np.asarray(groups)})
+            groups = pd.DataFrame(dict((c, np.asarray(groups[c])) for c in self.groupBy), columns=self.groupBy)
+            groups = pd.concat([self.groups, groups], ignore_index=True)
+        students = np.concatenate((self.students, np.asarray(students, dtype=object)))
+        scores = np.concatenate((self.scores, np.asarray(scores, dtype=float)))
+
+        codes, labels = groupCodes(groups if self.groupBy else None, len(scores))
+        keep = np.sort(selectTop(scores, codes, len(labels), self.n))
+        self.students = students[keep]
+        self.scores = scores[keep]
+        if self.groupBy:
+            self.groups = groups.iloc[keep].reset_index(drop=True)
+
+
+    def merge(self, other):
+        """ Combine with another accumulator over different students """
+        self.update(other.students, other.scores, other.groups if self.groupBy else None)
+
+
+    def table(self):
+        """ The current ranked table, see rank """
+        return rank(self.students, self.scores, n=self.n, groups=self.groups if self.groupBy else None)
@@ -0,0 +1,253 @@
+"""
+Seeded Resampling and Fold Plans
+"""
+
+#########################################################################################
+# Builds the stratified K-fold assignment of a cross validation run, the majority class #
+# subsample of every training fold and the seeds of any per-fold randomness up front,   #
+# with a single seeded NumPy generator, so that runs are reproducible and the folds     #
+# cost a handful of vectorized operations. Training matrices are gathered with one      #
+# indexing pass into a buffer that each process reuses from fold to fold.               #
+#########################################################################################
+
+import contextlib
+import numpy as np
+import scipy.sparse as sp
+
+
+# Part of the prediction cache keys: bump when the folds drawn for a seed change
+PLAN_VERSION = 2
+
+# Training matrix buffer of the current process, see gather and workspace
+_workspace = {}
+
+
+def randomState(seed):
+    """ A np.random.RandomState from a seed, an existing RandomState or None """
+    if isinstance(seed, np.random.RandomState):
+        return seed
+    return np.random.RandomState(seed)
+
+
+def assignFolds(y, nFolds, random_state=None, strict=True):
+    """ Stratified fold of every instance.
+
+    Each class is shuffled and dealt to the folds in turn, continuing where the
+    previous class stopped, so that fold sizes differ by at most one instance and
+    class proportions by at most one instance per class.
+
+    Parameters
+    ----------
+    y : np.ndarray
+        The labels
+    nFolds : int
+        The number of folds
+    random_state : int, np.random.RandomState or None
+        Seed of the shuffles
+    strict : bool
+        Require every class to appear in every fold. When False, only the whole set
+        needs nFolds instances and rare classes are missing from some folds
+
+    Returns
+    --------
+    np.ndarray
+        The fold, between 0 and nFolds - 1, of every instance
+    """
+    rs = randomState(random_state)
+    y = np.asarray(y)
+    classes, codes = np.unique(y, return_inverse=True)
+    if strict and np.bincount(codes).min() < nFolds:
+        raise ValueError('Every class needs at least nFolds=%d instances' % nFolds)
+    if len(y) < nFolds:
+        raise ValueError('At least nFolds=%d instances are needed' % nFolds)
+    folds = np.empty(len(y), dtype=np.intp)
+    offset = 0
+    for c in xrange(len(classes)):
+        members = np.flatnonzero(codes == c)
+        members = members[rs.permutation(len(members))]
+        folds[members] = (np.arange(len(members)) + offset) % nFolds
+        offset += len(members)
+    return folds
+
+
+def subsample(y, ix, ratio=1.0, random_state=None):
+    """ Majority class subsample of a set of training indexes.
+
+    Parameters
+    ----------
+    y : np.ndarray
+        The labels
+    ix : np.ndarray
+        The array indexes of the training instances
+    ratio : float
+        The ratio majority/minority to keep
+    random_state : int, np.random.RandomState or None
+        Seed of the subsample
+
+    Returns
+    --------
+    np.ndarray
+        The kept majority (c == 0) indexes followed by every minority (c == 1) index
+    """
+    rs = randomState(random_state)
+    ix = np.asarray(ix)
+    positive = y[ix] == 1
+    majority = ix[~positive]
+    size = min(int(np.count_nonzero(positive) * ratio), len(majority))
+    keep = majority[rs.permutation(len(majority))[:size]]
+    return np.concatenate((keep, ix[positive]))
+
+
+def oversample(y, ix, random_state=None):
+    """ Class-balanced oversample of a set of training indexes.
+
+    The instances of every class but the largest are drawn with replacement until
+    the class is as large as the largest one.
+
+    Parameters
+    ----------
+    y : np.ndarray
+        The labels, of any number of classes
+    ix : np.ndarray
+        The array indexes of the training instances
+    random_state : int, np.random.RandomState or None
+        Seed of the draws
+
+    Returns
+    --------
+    np.ndarray
+        Every index of ix followed by the drawn ones
+    """
+    rs = randomState(random_state)
+    ix = np.asarray(ix)
+    classes, codes = np.unique(y[ix], return_inverse=True)
+    counts = np.bincount(codes)
+    order = np.argsort(codes, kind='mergesort')
+    bounds = np.r_[0, np.cumsum(counts)]
+    extra = [ix[order[bounds[c] + rs.randint(counts[c], size=counts.max() - counts[c])]]
+             for c in xrange(len(classes)) if counts[c] < counts.max()]
+    return np.concatenate([ix] + extra)
+
+
+def nestedSubset(y, ix, fraction, random_state=None):
+    """ Stratified fraction of a set of training indexes.
+
+    Each class is shuffled and its first instances are kept, so that for the same
+    seed the subset of a smaller fraction is part of that of a larger one.
+
+    Parameters
+    ----------
+    y : np.ndarray
+        The labels
+    ix : np.ndarray
+        The array indexes of the training instances
+    fraction : float
+        The fraction of every class to keep, between 0 and 1
+    random_state : int, np.random.RandomState or None
+        Seed of the shuffle
+
+    Returns
+    --------
+    np.ndarray
+        The kept indexes, sorted
+    """
+    rs = randomState(random_state)
+    ix = np.asarray(ix)
+    shuffled = ix[rs.permutation(len(ix))]
+    positive = y[shuffled] == 1
+    keep = [members[:int(np.ceil(len(members) * fraction))] for members in (shuffled[~positive], shuffled[positive])]
+    return np.sort(np.concatenate(keep))
+
+
+class FoldPlan:
+
+    def __init__(self, y, nFolds=10, seed=None, subRate=None):
+        """ The folds of a cross validation run, drawn all at once.
+
+        Parameters
+        ----------
+        y : np.ndarray
+            The labels
+        nFolds : int
+            The number of folds
+        seed : int or None
+            Seed of the fold assignment, the subsamples and the per-fold seeds
+        subRate : float or None
+            When given, the majority class of every training fold is subsampled to
+            this ratio majority/minority
+
+        """
+        rs = randomState(seed)
+        self.folds = assignFolds(y, nFolds, rs)
+        self.nFolds = nFolds
+
+        # Test indexes of every fold, from a single stable sort of the assignment
+        order = np.argsort(self.folds, kind='mergesort')
+        bounds = np.r_[0, np.cumsum(np.bincount(self.folds, minlength=nFolds))]
+        self.test = [order[bounds[i]:bounds[i + 1]] for i in xrange(nFolds)]
+        self.train = [np.flatnonzero(self.folds != i) for i in xrange(nFolds)]
+        if subRate is not None:
+            self.train = [subsample(y, train, subRate, rs) for train in self.train]
+
+        # Seeds of the randomness inside each fold, e.g. SMOTE
+        self.seeds = rs.randint(np.iinfo(np.int32).max, size=nFolds) if seed is not None else [None] * nFolds
+
+
+    def __iter__(self):
+        return iter(zip(self.train, self.test))
+
+
+@contextlib.contextmanager
+def workspace():
+    """ Scope of the training matrix buffer of this process, released on exit, so that
+    a fold-sized matrix does not outlive the cross validation run that needed it.
+    Worker processes drop theirs when their pool is closed.
+    """
+    try:
+        yield
+    finally:
+        _workspace.clear()
+
+
+def gather(X, rows, extra=None, reuse=False):
+    """ Rows of X, optionally followed by extra rows, copied in a single pass.
+
+    Parameters
+    ----------
+    X : np.ndarray or scipy.sparse matrix
+        The entire dataset
+    rows : np.ndarray
+        The array indexes of the rows to gather
+    extra : np.ndarray or None
+        Additional rows appended after them, e.g. SMOTEd instances
+    reuse : bool
+        Write dense rows into a buffer kept by this process and reused by the next
+        call, instead of allocating a new matrix. The returned matrix is then only
+        valid until the next call with reuse=True. The buffer is released when the
+        enclosing workspace block ends
+
+    Returns
+    --------
+    np.ndarray or scipy.sparse.csr_matrix
+        The gathered rows
+    """
+    if sp.issparse(X):
+        X_rows = X[rows]
+        if extra is None or len(extra) == 0:
+            return X_rows
+        return sp.vstack((X_rows, sp.csr_matrix(extra)), format='csr')
+
+    nExtra = 0 if extra is None else len(extra)
+    shape = (len(rows) + nExtra, X.shape[1])
+    if reuse:
+        size = shape[0] * shape[1]
+        buf = _workspace.get('buffer')
+        if buf is None or buf.dtype != X.dtype or buf.size < size:
+            buf = _workspace['buffer'] = np.empty(size, dtype=X.dtype)
+        out = buf[:size].reshape(shape)
+    else:
+        out = np.empty(shape, dtype=X.dtype)
+    np.take(X, rows, axis=0, out=out[:len(rows)])
+    if nExtra:
+        out[len(rows):] = extra
+    return out
@@ -0,0 +1,171 @@
+"""
+Incremental Rescoring
+"""
+
+#########################################################################################
+# Refreshes risk scores as new marking-period, attendance and suspension data arrive    #
+# during the school year. A new extract is compared with the snapshot of the previous   #
+# one by student id, and only new students and students whose records changed are      #
+# encoded and scored by the fitted pipeline. Linear models with partial_fit can also be #
+# updated online with newly labeled students. Every update is recorded as a new version #
+# in a score history that keeps all past scores.                                        #
+#########################################################################################
+
+import copy
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+import pipeline
+
+
+def changedRows(previous, current):
+    """ Ids of the students that are new or whose records changed.
+
+    Parameters
+    ----------
+    previous : pd.DataFrame or None
+        The previous extract, indexed by student id
+    current : pd.DataFrame
+        The new extract, indexed by student id, with the columns to compare
+
+    Returns
+    --------
+    (pd.Index, pd.Index)
+        The ids of new students and of students with at least one changed value.
+        Values missing in both extracts count as unchanged
+    """
+    if previous is None:
+        return current.index, current.index[:0]
+    isNew = ~current.index.isin(previous.index)
+    common = current.index[~isNew]
+    old = previous.reindex(common)
+
+    changed = np.zeros(len(common), dtype=bool)
+    for column in current.columns:
+        a = current[column].values[~isNew]
+        if column not in old.columns:
+            changed[:] = True
+            break
+        b = old[column].values
+        if str(current[column].dtype) == 'category' or str(old[column].dtype) == 'category':
+            a = np.asarray(a, dtype=object); b = np.asarray(b, dtype=object)
+        changed |= ~((a == b) | (pd.isnull(a) & pd.isnull(b)))
+    return current.index[isNew], common[changed]
+
+
+class Rescorer:
+
+    def __init__(self, riskPipeline, directory):
+        """ Incremental scoring of successive extracts of the same cohort.
+
+        The directory holds the snapshot of the last extract (snapshot.pkl), the score
+        history (history.csv, with one row per student and version) and, after online
+        updates, the updated pipeline of every version (pipeline-<version>.pkl).
+
+        Parameters
+        ----------
+        riskPipeline : pipeline.RiskPipeline
+            A fitted pipeline, see classification.Model.fitPipeline
+        directory : string
+            The directory holding the state of the rescorer, created if needed
+
+        """
+        self.pipeline = riskPipeline
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.snapshotPath = os.path.join(directory, 'snapshot.pkl')
+        self.historyPath = os.path.join(directory, 'history.csv')
+
+        # Resume after the latest version, from the latest updated pipeline if any
+        self.version = 0
+        if os.path.exists(self.historyPath):
+            self.version = int(pd.read_csv(self.historyPath, usecols=['version'])['version'].max())
+        updated = [int(m.group(1)) for m in map(re.compile(r'pipeline-(\d+)\.pkl$').match, os.listdir(directory)) if m]
+        if updated:
+            self.version = max(self.version, max(updated))
+            self.pipeline = pipeline.RiskPipeline.load(self.pipelinePath(max(updated)))
+
+
+    def pipelinePath(self, version):
+        return os.path.join(self.directory, 'pipeline-%d.pkl' % version)
+
+
+    def snapshot(self):
+        """ The columns of the last extract used for scoring, or None before the first update """
+        if not os.path.exists(self.snapshotPath):
+            return None
+        return pd.read_pickle(self.snapshotPath)
+
+
+    def update(self, extract, labels=None):
+        """ Score the new and changed students of a new extract.
+
+        Parameters
+        ----------
+        extract : pd.DataFrame
+            The new extract, indexed by student id, with at least the columns listed
+            in pipeline.columns
+        labels : pd.Series or None
+            Outcomes that became known since the last update, indexed by student id.
+            When given, the classifier is first updated online with those students
+            (see pipeline.RiskPipeline.partialFit). Scores of students whose records
+            did not change are not recomputed
+
+        Returns
+        --------
+        pd.DataFrame
+            The scored students, indexed by student id, with columns risk, status
+            ('new' or 'changed') and version
+        """
+        current = extract[self.pipeline.columns]
+        new, changed = changedRows(self.snapshot(), current)
+        version = self.version + 1
+
+        # Update a copy, which only replaces the pipeline once everything else is recorded
+        scorer = self.pipeline
+        if labels is not None and len(labels):
+            labels = labels[labels.index.isin(current.index)].dropna()
+            scorer = copy.deepcopy(self.pipeline)
+            scorer.partialFit(current.reindex(labels.index), labels.values.astype(int))
+
+        ids = new.append(changed)
+        risk = scorer.predictRisk(current.loc[ids]).values if len(ids) else np.zeros(0)
+        scores = pd.DataFrame({'risk': risk,
+                               'status': ['new'] * len(new) + ['changed'] * len(changed),
+                               'version': version,
+                               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                              index=ids, columns=['risk', 'status', 'version', 'timestamp'])
+        scores.index.name = current.index.name or 'id'
+
+        # Append to the history in one write, replace the snapshot, and only then save
+        # the updated pipeline and move to the new version
+        exists = os.path.exists(self.historyPath)
+        rows = scores.to_csv(None, header=not exists, float_format='%.6f')
+        with open(self.historyPath, 'a') as f:
+            f.write(rows)
+        tmp = self.snapshotPath + '.tmp'
+        current.to_pickle(tmp)
+        os.rename(tmp, self.snapshotPath)
+        if scorer is not self.pipeline:
+            scorer.save(self.pipelinePath(version))
+            self.pipeline = scorer
+        self.version = version
+        return scores
+
+
+    def history(self):
+        """ Every score recorded so far, one row per student and version """
+        if not os.path.exists(self.historyPath):
+            return None
+        return pd.read_csv(self.historyPath, index_col=0)
+
+
+    def scores(self):
+        """ The latest risk score of every student scored so far """
+        history = self.history()
+        if history is None:
+            return None
+        return history[~history.index.duplicated(keep='last')]
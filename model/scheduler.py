@@ -0,0 +1,145 @@
+"""
+Parallel Task Scheduler
+"""
+
+#########################################################################################
+# Runs independent training tasks (one per model, fold and resampling variant) on a     #
+# pool of worker processes. The training data is written once to memory-mapped .npy     #
+# files that every worker maps read-only, instead of being pickled into each task, and  #
+# estimators that parallelize internally are capped so that the pool as a whole stays   #
+# within the requested core budget.                                                     #
+#########################################################################################
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import clone
+import instrument
+
+
+# Training data as seen by the worker processes, see _initWorker
+_shared = {}
+
+
+def coreBudget(nJobs):
+    """ Number of cores a run may use, following the sklearn n_jobs convention """
+    if nJobs is None:
+        return 1
+    if nJobs < 0:
+        return max(1, multiprocessing.cpu_count() + 1 + nJobs)
+    return max(1, nJobs)
+
+
+def limitThreads(clf, nThreads):
+    """ Copy of an estimator whose internal parallelism is capped at nThreads """
+    clf = clone(clf)
+    params = clf.get_params()
+    for name in params:
+        if name == 'n_jobs' or name.endswith('__n_jobs'):
+            clf.set_params(**{name: nThreads})
+    return clf
+
+
+def _share(data, directory, name):
+    """ Write an array, or the parts of a sparse matrix, to .npy files """
+    if sp.issparse(data):
+        data = data.tocsr()
+        parts = {}
+        for part in ('data', 'indices', 'indptr'):
+            parts[part] = os.path.join(directory, name + '_' + part + '.npy')
+            np.save(parts[part], getattr(data, part))
+        return ('csr', parts, data.shape)
+    path = os.path.join(directory, name + '.npy')
+    np.save(path, np.asarray(data))
+    return ('dense', path, None)
+
+
+def _attach(spec):
+    """ Memory-map data written by _share """
+    kind, paths, shape = spec
+    if kind == 'dense':
+        return np.load(paths, mmap_mode='r')
+    parts = [np.load(paths[part], mmap_mode='r') for part in ('data', 'indices', 'indptr')]
+    return sp.csr_matrix(tuple(parts), shape=shape, copy=False)
+
+
+def _initWorker(specs):
+    for name, spec in specs.items():
+        _shared[name] = _attach(spec)
+
+
+def _call(function, X, y, taskArgs, capturing):
+    """ Run a task, collecting its instrument spans when capturing """
+    start = time.time()
+    if not capturing:
+        return function(X, y, *taskArgs), time.time() - start, []
+    with instrument.capture() as spans:
+        result = function(X, y, *taskArgs)
+    return result, time.time() - start, spans
+
+
+def _runTask(args):
+    function, taskId, taskArgs, capturing = args
+    result, seconds, spans = _call(function, _shared['X'], _shared['y'], taskArgs, capturing)
+    return taskId, result, seconds, os.getpid(), spans
+
+
+def _emit(taskId, spans):
+    """ Send the spans of a task to the sinks of this process """
+    for record in spans:
+        record['task'] = taskId
+        instrument.emit(record)
+
+
+def runTasks(function, tasks, X, y, nJobs=None):
+    """ Run training tasks, possibly in parallel
+
+    Parameters
+    ----------
+    function : callable
+        A module level function called as function(X, y, *args) for every task
+    tasks : list
+        A list of (taskId, args) tuples, where args holds the picklable task arguments.
+        Estimators found in args are expected to be already capped with limitThreads
+    X : np.ndarray or scipy.sparse matrix
+        The training data shared by all tasks
+    y : np.ndarray
+        The labels shared by all tasks
+    nJobs : int or None
+        The number of cores to use. None runs every task in the current process,
+        -1 uses all cores
+
+    Returns
+    --------
+    generator
+        Yields (taskId, result, seconds, pid) as tasks complete. The instrument spans
+        of each task are emitted in the calling process, tagged with the task id
+    """
+    nWorkers = min(coreBudget(nJobs), len(tasks))
+    capturing = instrument.active()
+    if nJobs is None or nWorkers <= 1:
+        for taskId, taskArgs in tasks:
+            result, seconds, spans = _call(function, X, y, taskArgs, capturing)
+            _emit(taskId, spans)
+            yield taskId, result, seconds, os.getpid()
+        return
+
+    directory = tempfile.mkdtemp(prefix='scheduler-')
+    try:
+        specs = {'X': _share(X, directory, 'X'), 'y': _share(y, directory, 'y')}
+        pool = multiprocessing.Pool(nWorkers, initializer=_initWorker, initargs=(specs,))
+        try:
+            jobs = [(function, taskId, taskArgs, capturing) for taskId, taskArgs in tasks]
+            for taskId, result, seconds, pid, spans in pool.imap_unordered(_runTask, jobs):
+                _emit(taskId, spans)
+                yield taskId, result, seconds, pid
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
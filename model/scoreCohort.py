@@ -0,0 +1,62 @@
+"""
+Batch scoring of a student cohort with a saved risk pipeline
+
+Usage:
+    python scoreCohort.py pipeline.pkl new_cohort.csv risk_scores.csv
+    python scoreCohort.py pipeline.pkl new_extract.csv rescored.csv --history scores/
+
+The pipeline file is produced by classification.Model.fitPipeline(...).save(path).
+Only the modules needed to read the cohort and run the saved classifier are imported,
+so no model is retrained and neither matplotlib nor the other estimators are loaded.
+
+With --history, only the students that are new or whose records changed since the
+previous extract scored with the same history directory are scored, see rescoring.py.
+
+With --check, the written scores are compared with those RiskPipeline.predictRisk gives
+the cohort read with pandas' default types, and the run fails if they differ.
+"""
+
+import argparse
+import time
+import ingest
+import pipeline
+import rescoring
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a cohort CSV with a saved risk pipeline')
+    parser.add_argument('pipeline', help='pipeline file written by RiskPipeline.save')
+    parser.add_argument('cohort', help='CSV file of student records, student ids in the first column')
+    parser.add_argument('output', help='CSV file the student ids and risk scores are written to')
+    parser.add_argument('--chunksize', type=int, default=100000, help='number of students scored at once')
+    parser.add_argument('--history', default=None, help='directory of the snapshot and score history of the cohort')
+    parser.add_argument('--check', action='store_true', help='compare the scores with RiskPipeline.predictRisk')
+    args = parser.parse_args()
+    if args.check and args.history is not None:
+        parser.error('--check only applies to full scoring runs, without --history')
+
+    start = time.time()
+    risk_pipeline = pipeline.RiskPipeline.load(args.pipeline)
+    loaded = time.time()
+    if args.history is None:
+        scored = ingest.scoreFile(args.cohort, risk_pipeline, args.output, chunksize=args.chunksize)
+    else:
+        rescorer = rescoring.Rescorer(risk_pipeline, args.history)
+        header = ingest.readCohort(args.cohort, nrows=0)
+        columns = [header.index.name] + rescorer.pipeline.columns
+        scores = rescorer.update(ingest.readCohort(args.cohort, usecols=lambda c: c in columns))
+        scores.to_csv(args.output, float_format='%.6f')
+        scored = len(scores)
+        print 'Version %d: %d new and %d changed students' % (rescorer.version, (scores.status == 'new').sum(),
+                                                             (scores.status == 'changed').sum())
+    done = time.time()
+
+    print 'Loaded %s pipeline in %.3fs' % (risk_pipeline.model, loaded - start)
+    print 'Scored %d students in %.3fs (%d students/s)' % (scored, done - loaded, scored / max(done - loaded, 1e-9))
+    if args.check:
+        difference = ingest.checkScores(args.cohort, risk_pipeline, args.output, chunksize=args.chunksize)
+        print 'Scores match RiskPipeline.predictRisk up to %.2g' % difference
+
+
+if __name__ == '__main__':
+    main()
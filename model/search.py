@@ -0,0 +1,147 @@
+"""
+Hyperparameter Search
+"""
+
+#########################################################################################
+# Tunes the parameters of the classifiers in classification.clfs by successive halving. #
+# Every candidate parameter set is cross validated on a small budget (a fraction of     #
+# every training fold, or of the boosting rounds), and only the best third of the       #
+# candidates of each model, by precision at the top K, move on to a three times larger  #
+# budget, until the survivors are evaluated on the full training folds. All candidates #
+# of a rung run together on one pool of worker processes, on the processed dataset and #
+# the fold plan of the Model, which are never recomputed.                               #
+#########################################################################################
+
+import logging
+import math
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+import classification
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+def candidates(space, nCandidates=None, random_state=None):
+    """ Parameter sets drawn from a search space.
+
+    Parameters
+    ----------
+    space : dict
+        Values to try for every parameter, as lists or as scipy.stats distributions
+    nCandidates : int or None
+        The number of parameter sets. Every combination is returned when space only
+        holds lists and there are at most nCandidates of them
+    random_state : int, np.random.RandomState or None
+        Seed of the draws
+
+    Returns
+    --------
+    list
+        The parameter sets, as dicts
+    """
+    if all(isinstance(v, (list, tuple)) for v in space.values()):
+        grid = ParameterGrid(space)
+        if nCandidates is None or nCandidates >= len(grid):
+            return list(grid)
+    elif nCandidates is None:
+        raise ValueError('nCandidates is needed to draw parameters from distributions')
+    return list(ParameterSampler(space, nCandidates, random_state=random_state))
+
+
+def successiveHalving(pred, spaces, topK=.1, nCandidates=27, eta=3, minBudget=None, resource='rows',
+                      nFolds=10, doSubsampling=False, subRate=1.0, doSMOTE=False, pctSMOTE=100,
+                      smoteAlgorithm='auto', seed=0, cacheDir=None, nJobs=None):
+    """ Search the parameters of several models by successive halving
+
+    Parameters
+    ----------
+    pred : classification.Model
+        The preprocessed dataset, reused by every candidate
+    spaces : dict
+        The search space of every model code, see candidates, e.g.
+        {'RF': {'n_estimators': [100, 300], 'max_depth': [None, 8, 16]}}
+    topK : float
+        The fraction of students at highest risk the precision is computed on
+    nCandidates : int
+        The number of parameter sets drawn for each model
+    eta : int
+        The fraction 1/eta of the candidates kept after each rung, and the factor
+        the budget grows by
+    minBudget : float or None
+        The smallest budget, as a fraction of the full one. By default the first rung
+        is small enough for a single candidate to reach the full budget
+    resource : string
+        What the budget limits: 'rows' of every training fold, or the name of a
+        parameter such as 'n_estimators', scaled from its value in the candidate or
+        in clfs. Models without that parameter are budgeted by rows
+    nFolds, doSubsampling, subRate, doSMOTE, pctSMOTE, smoteAlgorithm, nJobs :
+        See classification.Model.crossValidateModels. With doSMOTE, candidates are
+        ranked on their SMOTE variant
+    seed : int
+        Seed of the parameter draws and of the fold plan shared by every rung
+    cacheDir : string or None
+        A directory where the full budget results are persisted, see crossValidateModels
+
+    Returns
+    --------
+    (dict, pd.DataFrame)
+        The best parameters of every model, ready to be passed as modelParams to
+        runClassification, and the precision of every candidate at every rung
+    """
+    rs = np.random.RandomState(seed)
+    variant = 'smote' if doSMOTE else 'base'
+    alive = dict((model, candidates(space, nCandidates, rs)) for model, space in sorted(spaces.items()))
+
+    # Budgets of the rungs, the last one being the full budget
+    nRungs = int(math.floor(math.log(max(len(c) for c in alive.values())) / math.log(eta) + 1e-9)) + 1
+    if minBudget is not None:
+        nRungs = min(nRungs, int(math.floor(math.log(1. / minBudget) / math.log(eta) + 1e-9)) + 1)
+    budgets = [float(eta) ** (rung - nRungs + 1) for rung in xrange(nRungs)]
+
+    rows = []; precision = {}
+    for rung, budget in enumerate(budgets):
+        specs = []; owners = []
+        for model in sorted(alive):
+            for i, params in enumerate(alive[model]):
+                params = dict(params); fraction = None if budget == 1 else budget
+                defaults = classification.estimator(model).get_params()
+                if resource != 'rows' and resource in defaults:
+                    full = params.get(resource, defaults[resource])
+                    params[resource] = max(1, int(round(full * budget)))
+                    fraction = None if budget == 1 else (resource, budget)
+                specs.append((model, None, classification._frozen(params), fraction))
+                owners.append((model, i))
+
+        logger.info('Rung %d: %d candidates on %.3g of the %s', rung, len(specs), budget,
+                    'training folds' if resource == 'rows' else resource)
+        results = pred._crossValidate(specs, pred.dataset, None, nFolds, doSubsampling, subRate, doSMOTE, pctSMOTE,
+                                      smoteAlgorithm, seed, cacheDir, nJobs)
+
+        scores = {}
+        for (model, i), spec, result in zip(owners, specs, results):
+            scores[(model, i)] = metrics.precisionAtK(pred.labels, result.prob[variant], topK)
+            rows.append({'model': model, 'rung': rung, 'budget': budget, 'params': alive[model][i],
+                         'precision': scores[(model, i)], 'seconds': np.nansum(result.seconds[variant])})
+            if budget < 1:
+                # Partial budget results, never written to cacheDir, are not kept in memory either
+                pred.predictions.pop(result.key, None)
+
+        # Keep the best 1/eta of the candidates of every model
+        for model in alive:
+            ranked = sorted(xrange(len(alive[model])), key=lambda i: -scores[(model, i)])
+            keep = ranked[:max(1, len(ranked) // eta)] if rung < nRungs - 1 else ranked[:1]
+            precision[model] = scores[(model, ranked[0])]
+            alive[model] = [alive[model][i] for i in keep]
+
+    table = pd.DataFrame(rows, columns=['model', 'rung', 'budget', 'params', 'precision', 'seconds'])
+    best = dict((model, dict(alive[model][0])) for model in alive)
+
+    print 'Best parameters by precision at top ' + str(100*topK) + '%'
+    print '%-8s %-12s %s' % ('Model', 'Precision', 'Parameters')
+    for model in sorted(best):
+        print '%-8s %-12.3f %s' % (model, precision[model], best[model])
+    print '\n'
+    return best, table
@@ -0,0 +1,327 @@
+"""
+Local risk scoring service
+
+Usage:
+    python service.py lr_pipeline.pkl --port 8000 --max-batch 512
+
+Serves a saved risk pipeline (see classification.Model.fitPipeline) over HTTP on the
+local machine, so that the dashboard and counselor tools can ask for the current risk
+of a student without rerunning the batch scoring.
+
+    POST /score   a JSON student record, a list of records or {"records": [...]}
+                  Every numeric field used by the pipeline is required, categorical
+                  fields may be missing or hold values unseen in training. The
+                  student id is read from the "id" field, when present.
+                  Returns {"id": ..., "risk": ...} for a single record and
+                  {"scores": [{"id": ..., "risk": ...}, ...]} otherwise
+    GET  /stats   request, record and batch counters, throughput and latency percentiles
+    GET  /health  {"status": "ok", "model": ...}
+
+Every request is parsed in its own thread and handed to a single batching thread, which
+coalesces the requests that queued up while the previous batch was being scored (up to
+max-batch records) into one encoded matrix and one predict_proba call. A max-delay of a
+few milliseconds makes the first request of a batch wait for others, trading latency for
+larger batches when throughput matters more.
+"""
+
+import argparse
+import BaseHTTPServer
+import collections
+import json
+import logging
+import Queue
+import SocketServer
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pipeline
+
+
+logger = logging.getLogger(__name__)
+
+# Number of recent requests the latency percentiles are computed over
+LATENCY_WINDOW = 10000
+
+
+class Stats:
+
+    def __init__(self):
+        """ Thread safe request, record and batch counters """
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0; self.records = 0; self.errors = 0
+        self.batches = 0; self.batchRecords = 0; self.maxBatch = 0; self.scoreSeconds = 0.
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+
+    def request(self, seconds, nRecords):
+        with self.lock:
+            self.requests += 1
+            self.records += nRecords
+            self.latencies.append(seconds)
+
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+
+    def batch(self, seconds, nRecords):
+        with self.lock:
+            self.batches += 1
+            self.batchRecords += nRecords
+            self.maxBatch = max(self.maxBatch, nRecords)
+            self.scoreSeconds += seconds
+
+
+    def summary(self):
+        """ The counters, throughput and latency percentiles in ms as a dict """
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            uptime = time.time() - self.started
+            out = {'uptime': uptime, 'requests': self.requests, 'records': self.records,
+                   'errors': self.errors, 'batches': self.batches, 'maxBatchRecords': self.maxBatch,
+                   'meanBatchRecords': self.batchRecords / float(max(self.batches, 1)),
+                   'meanBatchMs': 1000 * self.scoreSeconds / max(self.batches, 1),
+                   'requestsPerSecond': self.requests / uptime, 'recordsPerSecond': self.records / uptime}
+        if len(latencies):
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            out['latencyMs'] = {'p50': p50, 'p90': p90, 'p99': p99, 'max': latencies.max(),
+                                'window': len(latencies)}
+        return out
+
+
+class Pending:
+
+    def __init__(self, numeric, categorical):
+        """ A parsed request waiting for its scores """
+        self.numeric = numeric
+        self.categorical = categorical
+        self.size = len(numeric)
+        self.done = threading.Event()
+        self.risk = None
+        self.error = None
+
+
+class Batcher:
+
+    def __init__(self, riskPipeline, maxBatch=512, maxDelay=0., stats=None):
+        """ Scores the records of concurrent requests together.
+
+        Parameters
+        ----------
+        riskPipeline : pipeline.RiskPipeline
+            A fitted pipeline
+        maxBatch : int
+            The largest number of records scored at once
+        maxDelay : float
+            The longest time, in seconds, the first request of a batch waits for
+            others to join it. 0 only batches the requests already waiting
+        stats : Stats or None
+            The counters to update
+
+        """
+        self.pipeline = riskPipeline
+        self.maxBatch = maxBatch
+        self.maxDelay = maxDelay
+        self.stats = stats or Stats()
+        numeric = set(riskPipeline.encoder.numeric)
+        self.numeric = [c for c in riskPipeline.columns if c in numeric]
+        self.categorical = [c for c in riskPipeline.columns if c not in numeric]
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='batcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def parse(self, records):
+        """ The numeric fields of a list of JSON records as a float matrix, and the
+        categorical fields as an object matrix.
+
+        Raises ValueError when a numeric field is missing or not a number.
+        """
+        rows = [[r.get(c) for c in self.numeric] for r in records]
+        # Types are checked before converting, which would also accept numeric strings
+        if not all(isinstance(v, (int, long, float)) for row in rows for v in row):
+            for j, c in enumerate(self.numeric):
+                if not all(isinstance(row[j], (int, long, float)) for row in rows):
+                    raise ValueError('Field %s must be a number' % c)
+        numeric = np.array(rows, dtype=np.float64)
+        missing = np.isnan(numeric).any(axis=0)
+        if missing.any():
+            raise ValueError('Field %s must be a number' % self.numeric[np.argmax(missing)])
+        categorical = np.array([[r.get(c) for c in self.categorical] for r in records], dtype=object)
+        return numeric.reshape(len(records), len(self.numeric)), categorical.reshape(len(records), len(self.categorical))
+
+
+    def score(self, records):
+        """ Risk scores of a list of JSON records, once scored with a batch """
+        pending = Pending(*self.parse(records))
+        self.queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.risk
+
+
+    def _predict(self, batch):
+        """ Scores of a batch, from one DataFrame built from two blocks rather than column by column """
+        numeric = np.concatenate([p.numeric for p in batch]) if len(batch) > 1 else batch[0].numeric
+        frame = pd.DataFrame(numeric, columns=self.numeric, copy=False)
+        if self.categorical:
+            categorical = np.concatenate([p.categorical for p in batch]) if len(batch) > 1 else batch[0].categorical
+            frame = pd.concat([frame, pd.DataFrame(categorical, columns=self.categorical)], axis=1)
+        start = time.time()
+        risk = self.pipeline.predictRisk(frame).values
+        self.stats.batch(time.time() - start, len(numeric))
+        return risk
+
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            size = batch[0].size
+            deadline = time.time() + self.maxDelay
+            while size < self.maxBatch:
+                try:
+                    remaining = deadline - time.time()
+                    pending = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                batch.append(pending); size += pending.size
+
+            try:
+                risk = self._predict(batch)
+            except Exception:
+                # Score each request alone so that one bad record does not fail the others
+                risk = None
+                for pending in batch:
+                    try:
+                        pending.risk = self._predict([pending])
+                    except Exception as e:
+                        pending.error = e
+            offset = 0
+            for pending in batch:
+                if risk is not None:
+                    pending.risk = risk[offset:offset + pending.size]
+                    offset += pending.size
+                pending.done.set()
+
+
+class ScoringServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, batcher, idField='id'):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ScoringHandler)
+        self.batcher = batcher
+        self.stats = batcher.stats
+        self.idField = idField
+
+
+class ScoringHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Keep connections open between requests and send small responses right away
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def reply(self, status, body):
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.reply(200, self.server.stats.summary())
+        elif self.path == '/health':
+            self.reply(200, {'status': 'ok', 'model': self.server.batcher.pipeline.model})
+        else:
+            self.reply(404, {'error': 'Unknown path %s' % self.path})
+
+
+    def do_POST(self):
+        start = time.time()
+        if self.path != '/score':
+            return self.reply(404, {'error': 'Unknown path %s' % self.path})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.getheader('Content-Length', 0))))
+            single = isinstance(body, dict) and 'records' not in body
+            records = [body] if single else body['records'] if isinstance(body, dict) else body
+            if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+                raise ValueError('Expected a record, a list of records or {"records": [...]}')
+            risk = self.server.batcher.score(records) if records else []
+        except ValueError as e:
+            self.server.stats.error()
+            return self.reply(400, {'error': str(e)})
+        except Exception as e:
+            logger.exception('Scoring failed')
+            self.server.stats.error()
+            return self.reply(500, {'error': str(e)})
+
+        idField = self.server.idField
+        scores = [{'id': r.get(idField), 'risk': float(p)} for r, p in zip(records, risk)]
+        self.reply(200, scores[0] if single else {'scores': scores})
+        self.server.stats.request(time.time() - start, len(records))
+
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def serve(riskPipeline, host='127.0.0.1', port=8000, maxBatch=512, maxDelay=0., idField='id'):
+    """ Create a scoring server for a fitted pipeline.
+
+    Parameters
+    ----------
+    riskPipeline : pipeline.RiskPipeline
+        A fitted pipeline
+    host : string
+        The address to listen on, the local machine only by default
+    port : int
+        The port to listen on, 0 for any free port
+    maxBatch : int
+        The largest number of records scored at once
+    maxDelay : float
+        The longest time, in seconds, a request waits for others to be batched with
+    idField : string
+        The field of the records holding the student id
+
+    Returns
+    --------
+    ScoringServer
+        The server, to be run with serve_forever()
+    """
+    batcher = Batcher(riskPipeline, maxBatch, maxDelay)
+    return ScoringServer((host, port), batcher, idField)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='Serve risk scores of a saved pipeline over HTTP')
+    parser.add_argument('pipeline', help='pipeline file written by RiskPipeline.save')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('--max-batch', type=int, default=512, help='largest number of records scored at once')
+    parser.add_argument('--max-delay', type=float, default=0, help='milliseconds a request waits for others')
+    parser.add_argument('--id-field', default='id', help='field of the records holding the student id')
+    args = parser.parse_args()
+
+    server = serve(pipeline.RiskPipeline.load(args.pipeline), args.host, args.port, args.max_batch,
+                   args.max_delay / 1000., args.id_field)
+    logger.info('Serving %s risk scores on http://%s:%d', server.batcher.pipeline.model, *server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,20 @@
 import classification
+import logging
 import pandas as pd
 
+# Show progress messages (encoding, feature selection, ...)
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
 # Load simulated data set for experiment
 df = pd.read_csv('../data/simulated_data.csv',index_col=0)
 
 # Create a model object using the loaded data
-pred = classification.Model(df,'nograd')
+# The processed dataset is cached in ./cache as well and memory-mapped on reruns
+pred = classification.Model(df,'nograd', cacheDir='cache')
 
 # Run classification using 10-fold cross validation
 # Classifier used: Logistic Regression (LR)
 # Output format:List of risk scores for the top 5% of students at highest risk
-pred.runClassification(outputFormat='risk', models=['LR'], nFolds=10)
\ No newline at end of file
+# Out-of-fold results are cached in ./cache, so rerunning with another topK or
+# output format does not retrain the model
+pred.runClassification(outputFormat='risk', models=['LR'], nFolds=10, seed=0, cacheDir='cache')
@@ -0,0 +1,130 @@
+"""
+Synthetic Student Cohorts
+"""
+
+#########################################################################################
+# Generates student records with the layout of data/simulated_data.csv (absrateN,       #
+# nsuspN, mobilityN and q1mpaN..q4mpaN for every grade block N, and the nograd label)   #
+# plus categorical school codes, at any number of students. Every student has a latent  #
+# risk that drives all of their features, so the features are correlated across grades #
+# and predictive of the label as in the simulated data, and the label keeps its ~8.6%   #
+# rate of students who do not graduate on time. Large cohorts are generated and written #
+# in chunks.                                                                            #
+#########################################################################################
+
+import numpy as np
+import pandas as pd
+
+
+# Mean and standard deviation per grade block, as measured on data/simulated_data.csv,
+# and the loading of each family on the latent risk of the student
+FAMILIES = [('absrate', [4.21, 4.42, 4.64, 3.07, 3.74, 5.44, 8.75], [4.91, 5.37, 5.54, 4.65, 5.55, 7.94, 9.96], .5),
+            ('nsusp', [.07, .07, .04, .05, .05, .03, .03], [.36, .39, .28, .30, .34, .28, .24], .3),
+            ('mobility', [.47, .50, .52, .57, .60, .66, .69], [.82, .88, .92, .99, 1.03, 1.10, 1.14], .2),
+            ('q1mpa', [3.11, 3.03, 3.04, 2.99, 2.91, 2.95, 3.01], [.78, .85, .83, .83, .86, .82, .87], -.6),
+            ('q2mpa', [3.06, 2.97, 2.94, 2.88, 2.75, 2.84, 2.87], [.82, .86, .84, .89, .94, .92, .97], -.6),
+            ('q3mpa', [3.05, 3.02, 3.03, 2.99, 2.87, 2.92, 2.84], [.80, .84, .82, .84, .91, .89, .93], -.6),
+            ('q4mpa', [3.06, 3.01, 2.95, 2.92, 2.85, 2.90, 2.75], [.80, .79, .83, .91, .95, .92, .93], -.6)]
+
+# Fraction of students who do not graduate on time in data/simulated_data.csv
+NOGRAD_RATE = .086
+
+# Scale of the noise between the latent risk and the label
+LABEL_NOISE = .6
+
+
+def _threshold(rate, schoolSpread):
+    """ Latent risk above which a student does not graduate, from a fixed pilot sample """
+    rs = np.random.RandomState(0)
+    pilot = rs.randn(10**6) + schoolSpread * rs.randn(10**6) + LABEL_NOISE * rs.logistic(size=10**6)
+    return np.percentile(pilot, 100 * (1 - rate))
+
+
+def _chunk(first, n, nGrades, nSchools, schoolEffects, threshold, rs):
+    """ Records of students first to first + n - 1 """
+    risk = rs.randn(n)
+    columns = []; values = {}
+    school = rs.randint(0, nSchools, n) if nSchools else None
+    for g in xrange(nGrades):
+        for family, means, stds, loading in FAMILIES:
+            name = family + str(g + 1)
+            mean, std = means[min(g, len(means) - 1)], stds[min(g, len(stds) - 1)]
+            noise = rs.randn(n)
+            values[name] = (mean + std * (loading * risk + np.sqrt(1 - loading**2) * noise)).astype(np.float32)
+            columns.append(name)
+        if nSchools:
+            # Students change school more often when their mobility is high
+            if g:
+                moving = rs.rand(n) < .05 + .1 * (values['mobility' + str(g + 1)] > 1)
+                school = np.where(moving, rs.randint(0, nSchools, n), school)
+            name = 'school' + str(g + 1)
+            values[name] = pd.Categorical.from_codes(school, ['S%03d' % s for s in xrange(nSchools)])
+            columns.append(name)
+
+    effect = schoolEffects[school] if nSchools else 0
+    values['nograd'] = (risk + effect + LABEL_NOISE * rs.logistic(size=n) > threshold).astype(np.int64)
+    columns.append('nograd')
+    index = pd.Index(['st%08d' % i for i in xrange(first, first + n)], name='id')
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def chunks(nStudents, chunksize=100000, nGrades=7, rate=NOGRAD_RATE, nSchools=50, seed=None):
+    """ Generate a synthetic cohort chunk by chunk.
+
+    Parameters
+    ----------
+    nStudents : int
+        The number of students
+    chunksize : int
+        The number of students per chunk
+    nGrades : int
+        The number of grade blocks; blocks past the seventh reuse its distributions
+    rate : float
+        The expected fraction of students who do not graduate on time
+    nSchools : int
+        The number of school codes; 0 leaves the schoolN columns out
+    seed : int or None
+        Seed for the generator. The same seed and chunksize give the same cohort
+
+    Returns
+    --------
+    generator
+        Yields pd.DataFrame chunks indexed by student id, with the columns of
+        data/simulated_data.csv plus the categorical schoolN columns
+    """
+    rs = np.random.RandomState(seed)
+    schoolSpread = .3 if nSchools else 0.
+    schoolEffects = schoolSpread * rs.randn(max(nSchools, 1))
+    threshold = _threshold(rate, schoolSpread)
+    for first in xrange(0, nStudents, chunksize):
+        yield _chunk(first, min(chunksize, nStudents - first), nGrades, nSchools, schoolEffects, threshold, rs)
+
+
+def cohort(nStudents, nGrades=7, rate=NOGRAD_RATE, nSchools=50, seed=None, chunksize=100000):
+    """ A whole synthetic cohort in memory, see chunks for the parameters """
+    parts = list(chunks(nStudents, chunksize, nGrades, rate, nSchools, seed))
+    if len(parts) == 1:
+        return parts[0]
+    df = pd.concat(parts)
+    for column in df.columns:
+        if column.startswith('school'):
+            df[column] = pd.Categorical(df[column], categories=parts[0][column].cat.categories)
+    return df
+
+
+def writeCohort(path, nStudents, chunksize=100000, nGrades=7, rate=NOGRAD_RATE, nSchools=50, seed=None):
+    """ Write a synthetic cohort to a CSV file without holding it in memory.
+
+    See chunks for the parameters. The file can be read back with ingest.readCohort.
+
+    Returns
+    --------
+    int
+        The number of students written
+    """
+    written = 0
+    with open(path, 'w') as out:
+        for i, chunk in enumerate(chunks(nStudents, chunksize, nGrades, rate, nSchools, seed)):
+            chunk.to_csv(out, header=(i == 0), float_format='%.6f')
+            written += len(chunk)
+    return written
@@ -0,0 +1,251 @@
+"""
+Undermatch Analysis
+"""
+
+#########################################################################################
+# Measures the effect of a source variable (e.g. gender or race) on a binary target     #
+# outcome (e.g. college enrollment) among comparable students, as in                    #
+# undermatch/undermatching.ipynb: students are clustered on every other numeric column, #
+# and the rate of positive outcomes is tabulated for every source value and cluster.   #
+# Clustering uses mini-batch k-means fed chunk by chunk, so a whole state graduating    #
+# class can be streamed from a CSV file. Cluster assignments are computed once and      #
+# reused for every target column, and each table comes from a single bincount.          #
+#########################################################################################
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+import ingest
+
+
+# Tolerated standard error of the cells of a table, see Tables.sampleSize
+STANDARD_ERROR = .05
+
+
+def chunks(data, chunksize=100000, **kwargs):
+    """ Chunks of students from a DataFrame or a CSV file.
+
+    Parameters
+    ----------
+    data : pd.DataFrame or string
+        The students, or the path of a CSV file with student ids in its first column
+    chunksize : int
+        The number of students per chunk
+    kwargs : keyword arguments
+        Passed on to ingest.readCohort for CSV files
+
+    Returns
+    --------
+    iterator
+        The chunks, as DataFrames indexed by student id
+    """
+    if isinstance(data, pd.DataFrame):
+        return (data.iloc[start:start + chunksize] for start in xrange(0, len(data), chunksize))
+    kwargs.setdefault('na_values', 'NA')
+    return ingest.readCohort(data, chunksize=chunksize, **kwargs)
+
+
+class Tables:
+
+    def __init__(self, source, target, values, total, targeted, rate):
+        """ Counts and rates of positive outcomes by source value (rows) and cluster (columns).
+
+        Parameters
+        ----------
+        source : string
+            The source column
+        target : string
+            The target column
+        values : pd.Index
+            The source values, sorted
+        total : np.ndarray
+            The number of students of every source value in every cluster
+        targeted : np.ndarray
+            The number of them with a positive outcome
+        rate : float
+            The overall rate of positive outcomes
+
+        """
+        self.source = source
+        self.target = target
+        clusters = pd.Index(np.arange(total.shape[1]), name='cluster')
+        values = pd.Index(values, name=source)
+        self.total = pd.DataFrame(total, index=values, columns=clusters)
+        self.targeted = pd.DataFrame(targeted, index=values, columns=clusters)
+        self.prob = self.targeted / self.total.where(self.total > 0)
+        self.prob = self.prob.fillna(0.)
+        self.rate = rate
+
+        # Smallest cell giving a STANDARD_ERROR standard error on the rate
+        self.sampleSize = rate * (1. - rate) / STANDARD_ERROR ** 2
+        self.significant = self.total >= self.sampleSize
+
+
+    def heatmap(self):
+        """ The rates of the cells holding at least sampleSize students, NaN elsewhere """
+        return self.prob.where(self.significant)
+
+
+    def plot(self):
+        """ Draw the heatmap, greying out the cells below sampleSize """
+        import matplotlib
+        import matplotlib.pyplot as plt
+        data = np.ma.masked_invalid(self.heatmap().values)
+        cmap = matplotlib.cm.jet
+        cmap.set_bad('k', 0.8)
+
+        fig = plt.figure(figsize=(20, 12))
+        ax = fig.add_subplot(111)
+        cax = ax.matshow(data, interpolation='nearest', cmap=cmap)
+        fig.colorbar(cax)
+        ax.set_yticks(np.arange(data.shape[0]), minor=False)
+        ax.set_xticks(np.arange(data.shape[1]), minor=False)
+        ax.set_yticklabels([str(v) for v in self.prob.index])
+        ax.set_xticklabels([str(c) for c in self.prob.columns])
+        plt.xlabel('Clusters', fontsize=14, color='red')
+        plt.ylabel(self.source, fontsize=14, color='red')
+        for i, j in zip(*np.nonzero(~data.mask)):
+            plt.text(j - 0.05, i - 0.05, '%.2f' % data[i, j], horizontalalignment='center',
+                     verticalalignment='center')
+        plt.tight_layout()
+        plt.show()
+
+
+class Undermatch:
+
+    def __init__(self, nClusters=10, exclude=(), batchSize=10000, nPasses=1, random_state=0):
+        """ Clustering of students on every numeric column but the source and targets.
+
+        Parameters
+        ----------
+        nClusters : int
+            The number of clusters
+        exclude : list
+            Columns left out of the clustering, i.e. the source and target columns
+        batchSize : int
+            The number of students per mini-batch k-means update
+        nPasses : int
+            The number of passes over the data made by fit
+        random_state : int, np.random.RandomState or None
+            Seed of the k-means initialization and mini-batches
+
+        """
+        self.nClusters = nClusters
+        self.exclude = list(exclude)
+        self.batchSize = batchSize
+        self.nPasses = nPasses
+        self.kmeans = MiniBatchKMeans(n_clusters=nClusters, batch_size=batchSize, random_state=random_state)
+        self.columns = None
+        self.clusters = None
+        self.kept = None
+        self._codes = {}
+
+
+    def features(self, chunk):
+        """ The clustering matrix of a chunk of students.
+
+        String columns are dropped, as determined on the first chunk, and 'None',
+        unreadable and missing values become -1.
+        """
+        if self.columns is None:
+            self.columns = [c for c, tp in zip(chunk.columns, chunk.dtypes) if c not in self.exclude
+                            and not (tp == 'object' or str(tp) == 'category')]
+            if not self.columns:
+                raise ValueError('No numeric column left to cluster on')
+        X = np.empty((len(chunk), len(self.columns)))
+        for j, column in enumerate(self.columns):
+            values = chunk[column]
+            if values.dtype == object:
+                values = pd.to_numeric(values, errors='coerce')
+            X[:, j] = values.values
+        X[np.isnan(X)] = -1
+        return X
+
+
+    def fit(self, data, chunksize=100000):
+        """ Fit the clusters, one chunk and mini-batch at a time.
+
+        Parameters
+        ----------
+        data : pd.DataFrame or string
+            The students, or the path of a CSV file, see chunks
+        chunksize : int
+            The number of students read at once
+
+        Returns
+        --------
+        Undermatch
+            The fitted clustering itself
+        """
+        for _ in xrange(self.nPasses):
+            for chunk in chunks(data, chunksize):
+                X = self.features(chunk)
+                for start in xrange(0, len(X), self.batchSize):
+                    batch = X[start:start + self.batchSize]
+                    # The first update needs at least nClusters students
+                    if self.kmeans.__dict__.get('counts_') is None and len(batch) < self.nClusters:
+                        continue
+                    self.kmeans.partial_fit(batch)
+        return self
+
+
+    def assign(self, data, keep=(), chunksize=100000):
+        """ Cluster of every student, kept for every later table.
+
+        Parameters
+        ----------
+        data : pd.DataFrame or string
+            The students, or the path of a CSV file, see chunks
+        keep : list
+            Columns kept next to the clusters, i.e. the source and target columns the
+            tables will be built from, so that the data is not read again
+        chunksize : int
+            The number of students read at once
+
+        Returns
+        --------
+        pd.Series
+            The cluster of every student, indexed by student id
+        """
+        clusters = []; kept = []
+        for chunk in chunks(data, chunksize):
+            clusters.append(pd.Series(self.kmeans.predict(self.features(chunk)).astype(np.int32), index=chunk.index))
+            kept.append(chunk[list(keep)])
+        self.clusters = pd.concat(clusters)
+        self.clusters.name = 'cluster'
+        self.kept = pd.concat(kept)
+        self._codes = {}
+        return self.clusters
+
+
+    def table(self, source, target):
+        """ Counts and rates of positive target outcomes by source value and cluster.
+
+        Students with a missing source or target are left out.
+
+        Parameters
+        ----------
+        source : string
+            A column given to assign as keep, with the groups to compare
+        target : string
+            A binary column given to assign as keep, 1 for a positive outcome
+
+        Returns
+        --------
+        Tables
+            The counts, rates and significance of every cell
+        """
+        if self.clusters is None:
+            raise ValueError('Call assign before building tables')
+        if source not in self._codes:
+            self._codes[source] = pd.factorize(self.kept[source], sort=True)
+        codes, values = self._codes[source]
+
+        outcome = self.kept[target].values
+        valid = (codes >= 0) & ~pd.isnull(outcome)
+        positive = (outcome[valid] == 1).astype(np.intp)
+
+        # Count every (source value, cluster, outcome) cell at once
+        cells = (codes[valid] * self.nClusters + self.clusters.values[valid]) * 2 + positive
+        counts = np.bincount(cells, minlength=len(values) * self.nClusters * 2).reshape(len(values), self.nClusters, 2)
+        return Tables(source, target, values, counts.sum(axis=2), counts[:, :, 1], positive.mean())
@@ -0,0 +1,218 @@
+"""
+Time to Off-Track Urgency Scores
+"""
+
+#########################################################################################
+# Predicts when the students at risk of not graduating on time will go off-track       #
+# (be retained or drop out) for the first time, as survival/UrgencyScore.R does: for    #
+# every cutoff grade, a random forest trained on the data up to that grade, with        #
+# classes balanced by oversampling, predicts the first off-track grade of the at-risk   #
+# students by stratified cross validation. The at-risk students come from the out-of-   #
+# fold risk scores of a Model, the data of every grade is a column slice of its         #
+# processed dataset, and the folds of all grades run together on one pool of workers.  #
+#########################################################################################
+
+import logging
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.base import clone
+import classification
+import instrument
+import ranking
+import resampling
+import scheduler
+
+
+# Progress messages; results are printed
+logger = logging.getLogger(__name__)
+
+# Cutoff grades predicted from by default, as in UrgencyScore.R
+URGENCY_GRADES = [8, 9, 10, 11]
+
+
+def atRiskByGrade(pred, model='LR', grades=URGENCY_GRADES, topK=.1, families=classification.GRADE_FAMILIES,
+                  nFolds=10, seed=None, cacheDir=None, nJobs=None, modelParams=None):
+    """ Students at highest risk according to a model trained on the data up to each grade
+
+    The models are cross validated as by Model.sweepGrades, whose results are reused
+    when the same model, folds and seed were swept before.
+
+    Parameters
+    ----------
+    pred : classification.Model
+        The preprocessed dataset
+    model : string
+        The 2-3 letter code of the risk classifier
+    grades : list
+        The cutoff grades
+    topK : float
+        The fraction of students at highest risk kept at every grade
+    families, nFolds, seed, cacheDir, nJobs, modelParams :
+        See classification.Model.sweepGrades
+
+    Returns
+    --------
+    dict
+        The ids of the students at highest risk at every grade found, by decreasing risk
+    """
+    X, columns, cutoffs = pred.gradeView(families)
+    grades = [g for g in grades if g in cutoffs]
+    specs = [(model, cutoffs[g], classification._frozen((modelParams or {}).get(model)), None) for g in grades]
+    results = pred._crossValidate(specs, X, columns, nFolds, False, 1.0, False, 100, 'brute', seed, cacheDir, nJobs)
+    r = ranking.topCount(topK, len(pred.labels))
+    return dict((g, pd.Index(pred.students)[ranking.topK(result.prob['base'], r)]) for g, result in zip(grades, results))
+
+
+def urgencyTask(X, y, clf, train, test, nColumns, seed=None):
+    """ Train on one fold of the at-risk students of a grade and predict the others
+
+    This is the unit of work handed to scheduler.runTasks by urgencyScores.
+
+    Parameters
+    ----------
+    X : np.ndarray or scipy.sparse matrix
+        The dataset with columns ordered by grade, see Model.gradeView
+    y : np.ndarray
+        The first off-track grade of every student
+    clf : sklearn estimator
+        The classifier to be trained
+    train : np.ndarray
+        The array indexes of the training students
+    test : np.ndarray
+        The array indexes of the hold-out students
+    nColumns : int
+        The number of leading columns of X holding the data up to the cutoff grade
+    seed : int or None
+        Seed of the oversampling, the classifier being seeded by the caller
+
+    Returns
+    --------
+    np.ndarray
+        The predicted first off-track grade of every hold-out student
+    """
+    X = X[:, :nColumns]
+    with instrument.span('fold', train=len(train), test=len(test), features=X.shape[1]):
+        train = resampling.oversample(y, train, seed)
+        X_train = resampling.gather(X, train, reuse=True)
+        X_test = X[test]
+        if sp.issparse(X_train) and isinstance(clf, classification.DENSE_ONLY):
+            X_train = X_train.toarray(); X_test = X_test.toarray()
+        clf.fit(X_train, y[train])
+        return clf.predict(X_test)
+
+
+def urgencyScores(pred, offTrack, atRisk=None, grades=URGENCY_GRADES, model='RF', nFolds=10, riskModel='LR',
+                  topK=.1, families=classification.GRADE_FAMILIES, seed=None, cacheDir=None, nJobs=None,
+                  modelParams=None, outputDir=None):
+    """ Cross validated prediction of the first off-track grade of the at-risk students
+
+    For every cutoff grade, the at-risk students are dealt to stratified folds by
+    first off-track grade, and a classifier trained on the data up to the cutoff of
+    the other folds, with every off-track grade oversampled to the size of the most
+    frequent one, predicts the first off-track grade of each fold. The folds of all
+    grades run together, in parallel when nJobs is given.
+
+    Parameters
+    ----------
+    pred : classification.Model
+        The preprocessed dataset, built without PCA and without the off-track column
+    offTrack : pd.Series
+        The first off-track grade of every student, indexed by student id and coded
+        as in UrgencyScore.R: 1 for grade 7, 2 for grade 8 and so on, and one past the
+        last grade for students who never go off-track
+    atRisk : dict, list or None
+        The ids of the students to predict for at every cutoff grade, or one list of
+        ids for all grades. By default the topK fraction at highest risk according to
+        riskModel, see atRiskByGrade
+    grades : list
+        The cutoff grades
+    model : string
+        The 2-3 letter code of the classifier predicting the off-track grade, which
+        must handle more than two classes
+    nFolds : int
+        The number of folds at every grade
+    riskModel, topK :
+        The risk classifier and the fraction of students at highest risk selected
+        when atRisk is not given
+    families : list
+        The names of the grade-by-grade feature families
+    seed : int or None
+        Seed of the folds, of the oversampling, of model when it has a random_state
+        parameter and of the risk model folds. Runs with the same seed give the same
+        tables whatever nJobs
+    cacheDir, nJobs, modelParams :
+        See classification.Model.crossValidateModels. modelParams applies to both
+        model and riskModel
+    outputDir : string or None
+        When given, the table of every grade is also written there as <grade>.csv
+
+    Returns
+    --------
+    (dict, pd.DataFrame)
+        The predicted and true first off-track grade of the at-risk students at every
+        cutoff grade, indexed by student id, and the number of students, accuracy and
+        mean absolute error at every grade
+    """
+    X, columns, cutoffs = pred.gradeView(families)
+    grades = [g for g in grades if g in cutoffs]
+    if not grades:
+        raise ValueError('No grade-by-grade features found among ' + ', '.join(families))
+    if atRisk is None:
+        atRisk = atRiskByGrade(pred, riskModel, grades, topK, families, nFolds, seed, cacheDir, nJobs, modelParams)
+    elif not isinstance(atRisk, dict):
+        atRisk = dict((g, atRisk) for g in grades)
+
+    # First off-track grade of every processed student, -1 when unknown
+    students = pd.Index(pred.students)
+    y = offTrack.reindex(students).fillna(-1).values.astype(np.intp)
+
+    rs = resampling.randomState(seed)
+    rows = {}; folds = {}; tasks = []
+    clf = clone(classification.estimator(model, (modelParams or {}).get(model)))
+    nTasks = len(grades) * nFolds
+    if nJobs is not None:
+        nThreads = max(1, scheduler.coreBudget(nJobs) // max(1, min(scheduler.coreBudget(nJobs), nTasks)))
+        clf = scheduler.limitThreads(clf, nThreads)
+    for grade in grades:
+        positions = students.get_indexer(atRisk[grade])
+        if (positions < 0).any():
+            logger.warning('Grade %d: %d at-risk students are not in the dataset', grade, np.sum(positions < 0))
+        positions = positions[positions >= 0]
+        if (y[positions] < 0).any():
+            logger.warning('Grade %d: no off-track grade for %d at-risk students', grade, np.sum(y[positions] < 0))
+        rows[grade] = positions[y[positions] >= 0]
+        folds[grade] = resampling.assignFolds(y[rows[grade]], nFolds, rs, strict=False)
+        seeds = rs.randint(np.iinfo(np.int32).max, size=nFolds) if seed is not None else [None] * nFolds
+        for i in xrange(nFolds):
+            # The per-fold seed also seeds the classifier, e.g. the bootstrap of a random forest
+            foldClf = clf
+            if seed is not None and 'random_state' in clf.get_params():
+                foldClf = clone(clf).set_params(random_state=seeds[i])
+            tasks.append(((grade, i), (foldClf, rows[grade][folds[grade] != i], rows[grade][folds[grade] == i],
+                                       cutoffs[grade], seeds[i])))
+
+    predicted = dict((g, np.empty(len(rows[g]), dtype=np.intp)) for g in grades)
+    with instrument.span('urgencyScores', tasks=nTasks, rows=X.shape[0], features=X.shape[1], nJobs=nJobs), \
+            resampling.workspace():
+        for (grade, i), prediction, seconds, pid in scheduler.runTasks(urgencyTask, tasks, X, y, nJobs):
+            predicted[grade][folds[grade] == i] = prediction
+
+    tables = {}
+    summary = pd.DataFrame(index=pd.Index(grades, name='grade'), columns=['students', 'accuracy', 'mae'])
+    for grade in grades:
+        truth = y[rows[grade]]
+        tables[grade] = pd.DataFrame({'prediction': predicted[grade], 'truth': truth},
+                                     index=students[rows[grade]], columns=['prediction', 'truth'])
+        summary.loc[grade] = [len(truth), np.mean(predicted[grade] == truth),
+                              np.mean(np.abs(predicted[grade] - truth))]
+        if outputDir is not None:
+            tables[grade].to_csv(os.path.join(outputDir, '%d.csv' % grade), index_label=students.name or 'student')
+
+    print 'First off-track grade of at-risk students by cutoff grade'
+    print '%-8s %-10s %-10s %-10s' % ('Grade', 'Students', 'Accuracy', 'MAE')
+    for grade, row in summary.iterrows():
+        print '%-8d %-10d %-10.3f %-10.3f' % (grade, row['students'], row['accuracy'], row['mae'])
+    print '\n'
+    return tables, summary